@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test battery for little children: dotmixed and flanker experiment in one session.
+   Window, stimuli, response device and proband id are shared by the tasks, each task writes its own reports.
+   Response device: MilliKey device or keyboard
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import c_paradigm
+import dots_vers_20200708
+import flankervers_20200708
+
+__author__ = 'Alyona Lainburg'
+__version__ = 'v1.00 20261017'
+
+# tasks in order of presentation: paradigm and the parameters of the task script (data directory, stimuli, ...)
+tasks = (
+    ('Dots', dots_vers_20200708.parameters),
+    ('Flanker', flankervers_20200708.parameters),
+)
+
+# battery parameters, override the parameters of all tasks
+parameters = {
+    'Kiosk': False,  # continuous mode: return to the ID prompt after each participant instead of quitting
+    'StartupTiming': False,  # print the durations of the startup phases
+    'FrameTiming': False  # record flip intervals and write a timing summary next to each report file
+}
+
+
+###############################################################
+
+
+if __name__ == '__main__':
+    c_paradigm.run_battery(tasks, parameters, __version__, __author__)
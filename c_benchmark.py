@@ -0,0 +1,334 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the trial loop, device polling, report writing, result building and trial generation. The
+trial loop runs on the simulation backend (c_simulation), so only the processing overhead is measured. Results are
+written as JSON and can be compared with the results of another version.
+
+Usage: python c_benchmark.py [--output FILE] [--baseline FILE] [--quick]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy
+
+import c_device
+import c_experiment_core
+import c_file
+import c_plan
+import c_result
+import c_sequence
+import c_simulation
+import c_timeline
+import constant
+
+# format of the benchmark result files
+BENCHMARK_FORMAT_VERSION = 1
+# problem sizes of the benchmarks, reduced by --quick
+SIZES = {'trials': 20000, 'key_events': 500, 'rows': 200000, 'sessions': 300, 'reaction_times': 200000,
+         'sequence_trials': 1000, 'sequences': 1000, 'plans': 200}
+QUICK_SIZES = {'trials': 2000, 'key_events': 100, 'rows': 20000, 'sessions': 50, 'reaction_times': 20000,
+               'sequence_trials': 200, 'sequences': 100, 'plans': 20}
+
+
+class PerfClock:
+    """Monotonic clock with getTime(), like core.monotonicClock."""
+    def getTime(self):
+        return time.perf_counter()
+
+
+class InjectedKeyQueue:
+    """Key queue of the latency benchmark, like c_device.KeyboardQueue with the psychtoolbox backend: injected keys
+    are reported with the time stamp of the injection. The latency measured is the one of the reader and the trial
+    loop; the time stamping of the keyboard queue itself is not part of it."""
+    is_threadsafe = True
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def inject(self, key):
+        """Injects key event.
+        :param key: raw key name, e.g. 'left'
+        :return: time stamp of the key event
+        """
+        with self._lock:
+            key_time = self.clock.getTime()
+            self._keys.append((key, key_time))
+        return key_time
+
+    def get_keys(self, key_list):
+        with self._lock:
+            keys, self._keys = self._keys, []
+        return keys
+
+
+def get_statistics(values, count=None):
+    """Gets statistics of measured durations.
+    :param values: durations in seconds, one per measured operation
+    :param count: number of operations, if values holds a single total duration
+    :return: dictionary with count, mean, p50, p95 and p99 in microseconds and operations per second
+    """
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if count is None:
+        count = len(values)
+        p50, p95, p99 = numpy.percentile(values, (50, 95, 99)) * 1e6
+    else:
+        p50 = p95 = p99 = None
+    mean = float(numpy.sum(values)) / count
+    return {'count': count, 'mean_us': mean * 1e6, 'p50_us': None if p50 is None else float(p50),
+            'p95_us': None if p95 is None else float(p95), 'p99_us': None if p99 is None else float(p99),
+            'per_second': 1.0 / mean if mean > 0 else None}
+
+
+def get_session(data_path, responses, clock):
+    """Creates session of the simulation backend with open report file.
+    :param data_path: directory of the report files
+    :param responses: responses of the simulated device, see c_simulation.sample_responses
+    :param clock: c_simulation.SimulatedClock
+    :return: c_experiment_core.ExperimentSession
+    """
+    parameters = c_simulation.get_parameters('Dots', data_path)
+    parameters['SubjectID'] = 'bench'
+    plan = c_plan.create_plan('Dots', parameters, 0, 'bench')
+    exp_win = c_simulation.SimulatedWindow(clock)
+    session = c_experiment_core.ExperimentSession(parameters, plan, exp_win, c_simulation.SimulatedEvent(), clock,
+                                                  constant.KEYBOARD, c_simulation.SimulatedDevice(clock, responses),
+                                                  c_simulation.NullStimulusCache(), c_file.ReportWorker(), None)
+    session.timeline = c_timeline.TimelineScheduler(exp_win, exp_win.monitorFramePeriod, parameters['blank_duration'],
+                                                    parameters['FixDur'])
+    session.start_report()
+    session.report_worker.submit(session.trial_store.begin_step, 1)
+    session.report_worker.submit(session.timeline_store.begin_step, 1)
+    return session
+
+
+def get_trial(paradigm='Dots'):
+    """Gets trial without display.
+    :param paradigm: layout name in c_plan.LAYOUTS
+    :return: c_result.Trial
+    """
+    stimulus_id, (color, congruent) = sorted(c_plan.LAYOUTS[paradigm]['stimuli'].items())[0]
+    side = constant.STIMULI_IMAGE_POSITION_RIGHT
+    return c_result.Trial(c_result.Stimulus(stimulus_id, (), color, congruent), ((0, 0),) * 4, side, side,
+                          c_plan.LAYOUTS[paradigm]['key_rule'](color, side))
+
+
+def bench_trial_overhead(data_path, sizes):
+    """Processing time of instruct_pic_wait per test trial: flip, response, scoring and enqueued report rows.
+    The waiting time itself runs on the virtual clock."""
+    trial = get_trial()
+    number = sizes['trials']
+    clock = c_simulation.SimulatedClock()
+    responses = c_simulation.sample_responses([trial.expected_key] * number, numpy.random.default_rng(0))
+    session = get_session(data_path, responses, clock)
+    durations = numpy.empty(number)
+    try:
+        for i in range(number):
+            start_time = time.perf_counter()
+            session.instruct_pic_wait(trial, i, clock.getTime())
+            durations[i] = time.perf_counter() - start_time
+        drain_start = time.perf_counter()
+        session.report_worker.submit(session.data_file.close)
+        session.report_worker.drain()
+        drain_time = time.perf_counter() - drain_start
+    finally:
+        session.report_worker.shutdown()
+    statistics = get_statistics(durations)
+    statistics['report_drain_us'] = drain_time * 1e6
+    return statistics
+
+
+def bench_input_latency(data_path, sizes):
+    """Latency from a key event to its processing by process_key_pressed, through the device reader thread."""
+    clock = PerfClock()
+    key_queue = InjectedKeyQueue(clock)
+    parameters = c_simulation.get_parameters('Dots', data_path)
+    reader = c_device.DeviceReader(constant.KEYBOARD, key_queue, ('left', 'right'), 0.001)
+    reader.start()
+    session = c_experiment_core.ExperimentSession(parameters, c_plan.create_plan('Dots', parameters, 0),
+                                                  c_simulation.SimulatedWindow(c_simulation.SimulatedClock()),
+                                                  c_simulation.SimulatedEvent(), clock, constant.KEYBOARD, reader,
+                                                  c_simulation.NullStimulusCache(), c_file.ReportWorker(), None)
+    trial = get_trial()
+    latencies = []
+    try:
+        for i in range(sizes['key_events']):
+            reader.arm()
+            # the key events arrive at different phases of the reader poll interval
+            time.sleep(0.0005 * (i % 4))
+            key_time = key_queue.inject('right')
+            kb_presses = reader.get(1.0)
+            latencies.append(clock.getTime() - key_time)
+            session.process_key_pressed(kb_presses, trial, key_time, i, 0.0)
+            reader.disarm()
+    finally:
+        reader.stop()
+        session.report_worker.shutdown()
+    return get_statistics(latencies)
+
+
+def bench_write_stimuli_row(data_path, sizes):
+    """Report rows written per second, flushed after each row as in the blank interval of the trial loop."""
+    number = sizes['rows']
+    data_file = c_file.ReportWriter(os.path.join(data_path, 'bench_rows.txt'))
+    start_time = time.perf_counter()
+    for i in range(number):
+        c_file.write_stimuli_row(data_file, i % 32, 'R', 'red', 'R', constant.ANSWER_CORRECT, 0.4567, 12.345, 0.0)
+        data_file.flush()
+    data_file.close()
+    return get_statistics([time.perf_counter() - start_time], number)
+
+
+def bench_write_analysis(data_path, sizes):
+    """Time of write_analysis per session (single report rows and fragment of the general analysis report), and
+    of the on-demand merge of all fragments."""
+    result = c_result.Result(30, 93.75, 512.3, 498.7, 2, 0)
+    durations = []
+    data_file = c_file.ReportWriter(os.path.join(data_path, 'bench_analysis.txt'))
+    for i in range(sizes['sessions']):
+        start_time = time.perf_counter()
+        c_file.write_analysis(data_file, result, result, result, data_path, 'bench%05d' % i,
+                              '_Bench' + constant.REPORT_FILE_NAME)
+        durations.append(time.perf_counter() - start_time)
+    data_file.close()
+    statistics = get_statistics(durations)
+    # the write doesn't depend on the cohort size, the last sessions cost as much as the first ones
+    statistics['last_decile_mean_us'] = float(numpy.mean(durations[-max(1, len(durations) // 10):])) * 1e6
+    start_time = time.perf_counter()
+    c_file.merge_analysis_fragments(data_path, '_Bench' + constant.REPORT_FILE_NAME)
+    statistics['merge_us'] = (time.perf_counter() - start_time) * 1e6
+    return statistics
+
+
+def bench_build_result(data_path, sizes):
+    """Time of add_correct_time per reaction time and of build_result for a step with all reaction times."""
+    number = sizes['reaction_times']
+    reaction_times = numpy.random.default_rng(0).normal(0.5, 0.1, number)
+    cumulative_result = c_result.CumulativeResult()
+    start_time = time.perf_counter()
+    for reaction_time in reaction_times:
+        cumulative_result.add_correct_time(float(reaction_time))
+    cumulative_result.correct_count = number
+    add_time = time.perf_counter() - start_time
+    build_times = []
+    for _ in range(100):
+        start_time = time.perf_counter()
+        c_result.build_result(cumulative_result, number)
+        build_times.append(time.perf_counter() - start_time)
+    return {'add_correct_time': get_statistics([add_time], number), 'build_result': get_statistics(build_times)}
+
+
+def bench_generators(data_path, sizes):
+    """Time of the trial generators: constrained sequences at large N and complete session plans."""
+    rng = c_sequence.get_rng(0)
+    number = sizes['sequence_trials']
+    cell_counts = c_sequence.get_cell_counts(number, 4, rng)
+    start_time = time.perf_counter()
+    c_sequence.generate_sequences(cell_counts, sizes['sequences'], rng)
+    unconstrained_time = time.perf_counter() - start_time
+    # the run length constraint is met by rejection, so it is measured at block size
+    block_counts = c_sequence.get_cell_counts(32, 4, rng)
+    start_time = time.perf_counter()
+    c_sequence.generate_sequences(block_counts, sizes['sequences'], rng, [0, 0, 1, 1], 3, [1, 0, 1, 0])
+    constrained_time = time.perf_counter() - start_time
+    plan_times = []
+    for seed in range(sizes['plans']):
+        start_time = time.perf_counter()
+        c_plan.create_plan('Dots', c_plan.DEFAULT_PARAMETERS, seed)
+        plan_times.append(time.perf_counter() - start_time)
+    return {'sequences_unconstrained': get_statistics([unconstrained_time], sizes['sequences']),
+            'sequences_constrained': get_statistics([constrained_time], sizes['sequences']),
+            'create_plan': get_statistics(plan_times)}
+
+
+BENCHMARKS = (
+    ('trial_overhead', bench_trial_overhead),
+    ('input_latency', bench_input_latency),
+    ('write_stimuli_row', bench_write_stimuli_row),
+    ('write_analysis', bench_write_analysis),
+    ('build_result', bench_build_result),
+    ('generators', bench_generators),
+)
+
+
+def run_benchmarks(sizes=None, names=None):
+    """Runs benchmarks in a temporary data directory.
+    :param sizes: problem sizes or 'None' for SIZES
+    :param names: benchmark names or 'None' for all benchmarks
+    :return: result dictionary
+    """
+    sizes = SIZES if sizes is None else sizes
+    results = {}
+    for name, function in BENCHMARKS:
+        if names and name not in names:
+            continue
+        data_path = tempfile.mkdtemp(prefix='bench_')
+        try:
+            results[name] = function(data_path, sizes)
+        finally:
+            shutil.rmtree(data_path, ignore_errors=True)
+    return {'format': BENCHMARK_FORMAT_VERSION, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'numpy': numpy.__version__, 'sizes': sizes, 'results': results}
+
+
+def get_means(results, prefix=''):
+    """Flattens benchmark results to mean times.
+    :param results: 'results' of a result dictionary
+    :param prefix: name prefix of nested results
+    :return: dictionary benchmark name -> mean time in microseconds
+    """
+    means = {}
+    for name, value in results.items():
+        if 'mean_us' in value:
+            means[prefix + name] = value['mean_us']
+        else:
+            means.update(get_means(value, prefix + name + '.'))
+    return means
+
+
+def compare(baseline, current):
+    """Prints mean times of two result dictionaries.
+    :param baseline: result dictionary of the previous version
+    :param current: result dictionary of the current version
+    """
+    baseline_means = get_means(baseline['results'])
+    current_means = get_means(current['results'])
+    print('%-40s %14s %14s %8s' % ('benchmark', 'baseline(us)', 'current(us)', 'ratio'))
+    for name in sorted(current_means):
+        if name in baseline_means:
+            print('%-40s %14.3f %14.3f %8.2f' % (name, baseline_means[name], current_means[name],
+                                                 current_means[name] / baseline_means[name]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark trial loop, device polling and report writing.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run (default: all): %s'
+                        % ', '.join(name for name, _ in BENCHMARKS))
+    parser.add_argument('--output', default=None, help='JSON result file (default: print to stdout)')
+    parser.add_argument('--baseline', default=None, help='JSON result file of a previous version to compare with')
+    parser.add_argument('--quick', action='store_true', help='reduced problem sizes')
+    args = parser.parse_args(argv)
+    results = run_benchmarks(QUICK_SIZES if args.quick else SIZES, args.names)
+    text = json.dumps(results, indent=1)
+    if args.output:
+        c_file.write_atomic(args.output, text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            compare(json.load(file), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,87 +4,305 @@
 
 from __future__ import absolute_import, division, print_function
 
-import os
-import serial
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import constant
 
+# pyserial is imported on first use, so the device probing thread carries its import time
+
 
-def get_millikey_serial_port():
+def is_millikey_port_info(port_info):
+    """Checks USB vendor id and descriptor of a serial port for a MilliKey device.
+    :param port_info: serial.tools.list_ports_common.ListPortInfo
+    :return: 'True', if the port may belong to a MilliKey device
     """
-    Return list of serial port addresses that have been opened.
+    if port_info.vid in constant.MILLI_KEY_USB_VENDOR_IDS:
+        return True
+    descriptor = ' '.join(str(text) for text in (port_info.description, port_info.manufacturer, port_info.product)
+                          if text).lower()
+    return any(name in descriptor for name in constant.MILLI_KEY_DESCRIPTORS)
+
+
+def probe_serial_port(port):
+    """Checks, whether serial port can be opened with MilliKey settings.
+    :param port: serial port address
+    :return: 'True', if the port could be opened
+    """
+    import serial
+    try:
+        serial.Serial(port, baudrate=constant.MILLI_KEY_BAUDRATE, timeout=constant.MILLI_KEY_TIMEOUT).close()
+        return True
+    except (serial.SerialException, OSError, ValueError):
+        return False
+
+
+def read_cached_port(state_file):
+    """Reads serial port address cached by the last successful discovery.
+    :param state_file: path of the state file
+    :return: cached serial port address or 'None'
+    """
+    try:
+        with open(state_file, 'r') as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_cached_port(state_file, port):
+    """Caches serial port address for the next launch.
+    :param state_file: path of the state file
+    :param port: serial port address
+    """
+    try:
+        with open(state_file, 'w') as file:
+            file.write(port)
+    except OSError:
+        pass
+
+
+def get_millikey_serial_port(state_file=None):
+    """
+    Return list of MilliKey serial port addresses that could be opened.
+    The port cached in the state file is checked first, so the next launch connects immediately. Otherwise the
+    ports are filtered by USB vendor id or descriptor and the candidates are probed in parallel.
     See http://blog.labhackers.com/
+    :param state_file: path of the file caching the last good port or 'None' for no caching
+    :return: list of serial port addresses, beginning with the preferred one
     """
-    if os.name == 'nt':  # Windows
-        available = []
-        for i in range(1, 512):
+    from serial.tools import list_ports
+    port_infos = list_ports.comports()
+    if state_file:
+        cached = read_cached_port(state_file)
+        if cached in [port_info.device for port_info in port_infos] and probe_serial_port(cached):
+            return [cached]
+    candidates = [port_info.device for port_info in port_infos if is_millikey_port_info(port_info)]
+    if not candidates:
+        return []
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        available = [port for port, opened in zip(candidates, executor.map(probe_serial_port, candidates)) if opened]
+    if available and state_file:
+        write_cached_port(state_file, available[0])
+    return available
+
+
+class MilliKeySession:
+    """Long-lived serial session to the MilliKey device. The port is opened once for the whole run,
+    pending input is discarded during the fixation phase and the port is re-opened only after an I/O error."""
+    def __init__(self, port, baudrate=constant.MILLI_KEY_BAUDRATE, timeout=constant.MILLI_KEY_TIMEOUT):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self._connection = None
+
+    @property
+    def is_open(self):
+        """'True', if the serial port is currently open"""
+        return self._connection is not None and self._connection.is_open
+
+    def open(self):
+        """Opens the serial port, if it is not open yet.
+        :return: this session
+        """
+        import serial
+        if not self.is_open:
+            self._connection = serial.Serial(self.port, baudrate=self.baudrate, timeout=self.timeout)
+        return self
+
+    def close(self):
+        """Closes the serial port. Closing an already closed session has no effect."""
+        import serial
+        if self._connection is not None:
             try:
-                sport = 'COM%d' % i
-                s = serial.Serial(sport, baudrate=128000)
-                available.append(sport)
-                s.close()
-            except (serial.SerialException, ValueError):
+                self._connection.close()
+            except (serial.SerialException, OSError):
                 pass
-        return available
-    else:  # macOS and Linux
-        from serial.tools import list_ports
-        return [port[0] for port in list_ports.comports()]
-
-
-def get_start_time(device, core, trial_clock):
-    """Gets start time for provided device context.
-    :param device: current device.
-    :param core: psychoPy import core
-    :param trial_clock: core.Clock()
-    :return: start time
+            self._connection = None
+
+    def reconnect(self):
+        """Closes and re-opens the serial port after an I/O error."""
+        self.close()
+        return self.open()
+
+    def discard_input(self):
+        """Discards pending device input, e.g. key events sent during the fixation phase.
+        The port is re-opened only if the device reports an I/O error.
+        :return: 'False', if the device could not be re-opened, i.e. it is no longer available
+        """
+        import serial
+        try:
+            self.open()
+            self._connection.reset_input_buffer()
+        except (serial.SerialException, OSError):
+            try:
+                self.reconnect()
+            except (serial.SerialException, OSError, ValueError):
+                self.close()
+                return False
+        return True
+
+
+def open_millikey_session(port):
+    """Opens MilliKey session for provided serial port.
+    :param port: serial port address
+    :return: opened MilliKeySession or 'None', if MilliKey device is not available
     """
-    start_time = 0
-    if device == constant.PSYCHO_TOOLBOX:
-        # See http://blog.labhackers.com/?cat=29
-        evt_delay_sec = constant.MILLI_KEY_DELAY / 1000.0 / 1000.0
-        start_time = core.getTime() + evt_delay_sec
-    if device == constant.KEYBOARD:
-        start_time = trial_clock.getTime()
-    return start_time
-
-
-def get_presses_from_device(device, event, toolbox_wait_time, core, trial_clock, key_code):
-    """Gets two dimensional array with one element, containing event key and key reaction time.
+    import serial
+    try:
+        return MilliKeySession(port).open()
+    except (serial.SerialException, OSError, ValueError):
+        return None
+
+
+def get_device_key(device, key, key_code):
+    """Maps raw key name to the key code used by the experiment.
     :param device: current device
-    :param event: psychoPy import event
-    :param toolbox_wait_time: toolbox waiting time
-    :param core: psychoPy import core
-    :param trial_clock: core.Clock()
+    :param key: raw key name as reported by psychoPy event
     :param key_code: keyboard observed key codes (e.g. 'left' and 'right')
-    :return: two dimensional array with one element, containing event key and key reaction time
+    :return: 'q' for quit keys, LEFT_KEYCODE or RIGHT_KEYCODE for response keys, otherwise 'None'
     """
-    kb_presses = None
-    if device == constant.PSYCHO_TOOLBOX:
-        event_key = event.waitKeys(maxWait=toolbox_wait_time)
-        if event_key:
-            kb_presses = [[event_key[0], core.getTime()]]
-    if device == constant.KEYBOARD:
-        kb_presses = get_keyboard_response(event, trial_clock, key_code)
-    return kb_presses
-
-
-def get_keyboard_response(event, trial_clock, key_code):
-    """Gets two dimensional array with one element, containing event key and key reaction time from keyboard emulation.
-    :param event: psychoPy import event
-    :param trial_clock: core.Clock()
-    :param key_code: keyboard observed keycodes (e.g. 'left' and 'right')
-    :return: two dimensional array with one element, containing event key and key reaction time
+    if key in ['q', 'escape']:
+        return 'q'
+    if device == constant.KEYBOARD and key in key_code:
+        if key == 'right':
+            return constant.RIGHT_KEYCODE
+        return constant.LEFT_KEYCODE
+    if device == constant.PSYCHO_TOOLBOX and key in [constant.LEFT_KEYCODE, constant.RIGHT_KEYCODE]:
+        return key
+    return None
+
+
+def is_ptb_keyboard(keyboard_module, key_board):
+    """Checks, whether psychoPy keyboard uses the psychtoolbox backend. Newer psychoPy versions report the backend
+    by Keyboard.getBackend() or store it in Keyboard._backend, older versions choose psychtoolbox, if it is
+    available (keyboard.havePTB).
+    :param keyboard_module: from psychopy.hardware import keyboard
+    :param key_board: keyboard.Keyboard
+    :return: 'True', if key events are time stamped by the psychtoolbox keyboard queue
     """
-    act_key = -1
-    kb_presses = None
-    react_time_s = 0
-    for key in event.getKeys(timeStamped=trial_clock):
-        react_time_s = trial_clock.getTime()
-        act_key = key[0]
-    if act_key in ['q', 'escape']:
-        kb_presses = [['q', react_time_s]]
-    if act_key in key_code:
-        arrow = constant.LEFT_KEYCODE
-        if act_key == 'right':
-            arrow = constant.RIGHT_KEYCODE
-        kb_presses = [[arrow, react_time_s]]
-    return kb_presses
+    if hasattr(key_board, 'getBackend'):
+        return key_board.getBackend() == 'ptb'
+    if getattr(key_board, '_backend', None) is not None:
+        return key_board._backend == 'ptb'
+    return bool(getattr(keyboard_module, 'havePTB', False))
+
+
+class KeyboardQueue:
+    """Key events of psychopy.hardware.keyboard.Keyboard, time stamped on the provided clock. With the psychtoolbox
+    backend the events are queued and time stamped by the operating system keyboard queue, independent of the window
+    event dispatch of ExpWin.flip(), so the queue can be read on any thread. Other backends read psychoPy event,
+    which is only served on the thread of the window."""
+    def __init__(self, clock):
+        from psychopy.hardware import keyboard
+        self._keyboard = keyboard.Keyboard(clock=clock)
+        self.is_threadsafe = is_ptb_keyboard(keyboard, self._keyboard)
+
+    def get_keys(self, key_list):
+        """Gets and removes queued key presses.
+        :param key_list: raw key names to report
+        :return: list of raw key name and key time stamp
+        """
+        return [(key.name, key.rt) for key in self._keyboard.getKeys(keyList=key_list, waitRelease=False)]
+
+
+class DeviceReader(threading.Thread):
+    """Background reader for MilliKey and keyboard events, which arrive time stamped from the key queue and are put
+    into a bounded queue drained by the trial loop. The reader only consumes events while it is armed (between
+    stimulus onset and response), so dialogs keep their own key handling. A key queue, which is not thread-safe, is
+    polled by the trial loop itself when it drains the queue, i.e. after each flip."""
+    def __init__(self, device, key_queue, key_code, poll_interval, max_events=constant.DEVICE_QUEUE_SIZE):
+        threading.Thread.__init__(self, name='DeviceReader', daemon=True)
+        self.device = device
+        self.key_code = key_code
+        self.poll_interval = poll_interval
+        self._key_queue = key_queue
+        self._key_list = ['q', 'escape', constant.LEFT_KEYCODE, constant.RIGHT_KEYCODE] + list(key_code)
+        self._queue = queue.Queue(maxsize=max_events)
+        self._armed = threading.Event()
+        self._stopped = threading.Event()
+
+    @property
+    def is_threaded(self):
+        """'True', if the key queue is read on the reader thread"""
+        return self._key_queue.is_threadsafe
+
+    def start(self):
+        """Starts the reader thread, if the key queue can be read on it."""
+        if self.is_threaded:
+            threading.Thread.start(self)
+
+    def arm(self):
+        """Discards queued events and starts capturing."""
+        self.clear()
+        # key presses before the stimulus onset are no answers
+        self._key_queue.get_keys(self._key_list)
+        self._armed.set()
+
+    def disarm(self):
+        """Stops capturing until the reader is armed again."""
+        self._armed.clear()
+
+    def stop(self):
+        """Terminates the reader thread."""
+        self._stopped.set()
+        self._armed.set()
+
+    def clear(self):
+        """Discards all queued events."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def get(self, timeout):
+        """Waits for the next queued event.
+        :param timeout: maximum waiting time in seconds, values below 0 don't wait at all
+        :return: two dimensional array with one element, containing event key and key time stamp,
+        or 'None', if no event arrived in time
+        """
+        if not self.is_threaded:
+            return self._poll_get(timeout)
+        try:
+            if timeout <= 0:
+                return [self._queue.get_nowait()]
+            return [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+
+    def _poll_get(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while True:
+            self._read_keys()
+            try:
+                return [self._queue.get_nowait()]
+            except queue.Empty:
+                pass
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(min(self.poll_interval, max(deadline - time.perf_counter(), 0.0)))
+
+    def _put(self, press):
+        if self._queue.full():
+            # drop the oldest event rather than blocking the reader
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+        self._queue.put_nowait(press)
+
+    def _read_keys(self):
+        for key, key_time in self._key_queue.get_keys(self._key_list):
+            act_key = get_device_key(self.device, key, self.key_code)
+            if act_key is not None:
+                self._put([act_key, key_time])
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._armed.wait()
+            if self._stopped.is_set():
+                break
+            self._read_keys()
+            self._stopped.wait(self.poll_interval)
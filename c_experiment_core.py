@@ -1,46 +1,314 @@
 ﻿#!/usr/bin/env python
 # -*- coding: utf-8 -*-
-"""File related functionality. Currently supported: single report and general analysis report"""
+"""Experiment core: trial engine shared by the experiment scripts. Window, device reader, clock and stimulus cache
+are injected, so the same engine runs with PsychoPy or with the simulation backend (c_simulation)."""
 
+from __future__ import absolute_import, division, print_function
 
-import os
-
-import platform
-import sys
-import time
+import c_file
+import c_inputscreen
+import c_plan
+import c_result
+import c_store
+import c_timeline
+import c_visual
 import constant
 
 
-def get_initial_values(kpress, elements_pos):
-    """Gets initial values for single stimuli device response.
-      :param kpress: pressed key code.
-      :param elements_pos: two dimensional array of positional elements
-      :return: 'L' or 'R' for pressed key, '0' or '1' for correctness and 'L' or 'R' for element positioning
-    """
-    answ = constant.KEY_PRESSED_LEFT
-    answer = constant.ANSWER_INCORRECT
-    pos = constant.STIMULI_IMAGE_POSITION_LEFT
-    if kpress == constant.RIGHT_KEYCODE:
-        answ = constant.KEY_PRESSED_RIGHT
-    if elements_pos[0][0] > 0:
-        pos = constant.STIMULI_IMAGE_POSITION_RIGHT
-    return answ, answer, pos
-
-
-def end_experiment(end_flag, parameters, testMode, data_file, device, core, mk_connection):
-    """Ends current experiment.
-    :param end_flag: experiment execution flag. 'False', if experiment was premature terminated
+class ExperimentSession:
+    """Runs the blocks of a session plan: fixation cross, stimulus, response, scoring and report rows. Practice
+    blocks are not reported; the first test step opens the single report file and the structured trial store.
+    :param parameters: experiment parameters
+    :param plan: session plan, see c_plan
+    :param exp_win: visual.Window or c_simulation.SimulatedWindow
+    :param event: from psychoPy import event or c_simulation.SimulatedEvent
+    :param clock: clock of flip time stamps and key events (core.monotonicClock)
+    :param device: current device (KEYBOARD or PSYCHO_TOOLBOX)
+    :param device_reader: c_device.DeviceReader or c_simulation.SimulatedDevice
+    :param stim_cache: c_stimcache.StimulusCache or c_simulation.NullStimulusCache
+    :param report_worker: c_file.ReportWorker
+    :param instruct_text: instruction text element
+    :param mk_connection: c_device.MilliKeySession or 'None'
+    :param frame_timer: c_visual.FrameTimer or 'None'
+    :param quit_function: function called to terminate the process (core.quit) or 'None' to return
+    :param version: application version written into the report header
+    :param author: experiment author written into the report header
+    :param frame_period: measured frame period in seconds or 'None' for the nominal frame period of the window
     """
-    if end_flag:
-        end_text = 'terminated at the end of the experiment'
-    else:
-        end_text = 'terminated by escape key'
-    if parameters['MonitorFlag']:
-        print(end_text)
-    if parameters['DataFlag']:
-        print(end_text)
-    if testMode:
-        data_file.close()
-    if device == constant.PSYCHO_TOOLBOX:
-        mk_connection.close()
-    core.quit()
\ No newline at end of file
+    def __init__(self, parameters, plan, exp_win, event, clock, device, device_reader, stim_cache, report_worker,
+                 instruct_text, mk_connection=None, frame_timer=None, quit_function=None, version='',
+                 author='', frame_period=None):
+        self.parameters = parameters
+        self.plan = plan
+        self.exp_win = exp_win
+        self.event = event
+        self.clock = clock
+        self.device = device
+        self.device_reader = device_reader
+        self.stim_cache = stim_cache
+        self.report_worker = report_worker
+        self.instruct_text = instruct_text
+        self.mk_connection = mk_connection
+        self.frame_timer = frame_timer
+        self.quit_function = quit_function
+        self.version = version
+        self.author = author
+        self.frame_period = c_visual.get_frame_period(exp_win) if frame_period is None else frame_period
+        self.test_mode = False
+        self.cumulative_result = c_result.CumulativeResult()
+        self.data_file = None
+        self.trial_store = None
+        self.timeline_store = None
+        self.timeline = None
+        self.cross_screen = None
+
+    def end_experiment(self, end_flag, end_text=None):
+        """Ends current experiment.
+        :param end_flag: experiment execution flag. 'False', if experiment was premature terminated
+        :param end_text: reason of a premature termination or 'None' for the escape key
+        """
+        if end_flag:
+            end_text = 'terminated at the end of the experiment'
+        elif end_text is None:
+            end_text = 'terminated by escape key'
+        if self.parameters['MonitorFlag']:
+            print(end_text)
+        if self.parameters['DataFlag']:
+            print(end_text)
+        if self.data_file is not None:
+            self.report_worker.submit(self.data_file.close)
+            self.data_file = None
+        self.report_worker.shutdown()
+        if self.device == constant.PSYCHO_TOOLBOX and self.mk_connection is not None:
+            self.mk_connection.close()
+        if self.quit_function is not None:
+            self.quit_function()
+
+    def show_dialog(self, text):
+        """Displays text dialog.
+        :param text: text to display in the dialog
+        """
+        buffer = [text + ' \n\n\n\n', 'Weiter mit der ', self.parameters['WaitKeyText']]
+        pressed_key = c_visual.instruct_wait(self.instruct_text, ''.join(buffer), self.parameters['WaitKey'],
+                                             self.exp_win, self.event, self.stim_cache.compositor)
+        if pressed_key == 'q':
+            self.end_experiment(False)
+
+    def execute_shuffled_stimuli(self, stimuli):
+        """Executes shuffled stimuli using cross/image switching. If PSYCHO_TOOLBOX would
+        be used, the connection stays open and device input received during the cross is discarded
+        before switching to image
+        :param stimuli: list of c_result.Trial in the order of the session plan
+        """
+        # collected report rows are written while the cross is shown
+        blank_task = (lambda: self.report_worker.submit(self.data_file.flush)) if self.test_mode else None
+        for i, trial in enumerate(stimuli):
+            # the cross is shown for the planned number of frames, the stimulus follows with the next flip
+            if self.frame_timer is not None:
+                self.frame_timer.start()
+            cross_onset = self.timeline.show_blank(self.cross_screen, blank_task)
+            for keys in self.event.getKeys():
+                if keys in ['q', 'escape']:
+                    self.end_experiment(False)
+            if self.device == constant.PSYCHO_TOOLBOX and not self.mk_connection.discard_input():
+                # the device is gone: the report written so far is closed and the session ends
+                self.end_experiment(False, 'terminated, MilliKey device not available')
+            self.instruct_pic_wait(trial, i, cross_onset)
+
+    def do_stimuli_execution(self, dialog_text, stimuli):
+        """Carries out stimuli execution of one session plan block.
+        :param dialog_text: text for info dialog.
+        :param stimuli: list of c_result.Trial
+        """
+        if dialog_text is not None:
+            self.show_dialog(dialog_text)
+        self.execute_shuffled_stimuli(stimuli)
+
+    def write_trial_row(self, count, pos, color, answ, answer, diff_time, onset_time, onset_jitter, raw_response=None):
+        """Enqueues single report row and structured trial record.
+        :param count: current stimuli index (beginning with 0)
+        :param pos: tested field value, e.g. element position
+        :param color: stimuli element color
+        :param answ: key pressed ('L', 'R' or '-')
+        :param answer: correctness of the answer ('0', '1' or '-')
+        :param diff_time: reaction time in seconds
+        :param onset_time: stimulus onset (flip time stamp)
+        :param onset_jitter: difference between actual and intended stimulus onset in seconds
+        :param raw_response: key, correctness and reaction time of a too fast key press, kept in the trial store only
+        The trial store gets the frames dropped in the trial window up to the answer or timeout.
+        """
+        self.report_worker.submit(c_file.write_stimuli_row, self.data_file, count, pos, color, answ, answer,
+                                  diff_time, self.cumulative_result.cumulative_time, onset_jitter)
+        self.report_worker.submit(self.trial_store.append, count, pos, color, answ, answer, diff_time, onset_time,
+                                  onset_jitter, self.timeline.dropped_frames, raw_response)
+
+    def process_key_pressed(self, kb_presses, trial, stime, count, onset_jitter):
+        """Carries out key pressed event processing.
+        :param kb_presses: one dimensional array of key pressed event. Is empty, if no key was pressed
+        :param trial: c_result.Trial
+        :param stime: stimulus onset (flip time stamp) before key was pressed
+        :param count: current stimuli index (beginning with 0)
+        :param onset_jitter: difference between actual and intended stimulus onset in seconds
+        :return: 'True', if 'left' of 'right' device key was pressed
+        """
+        key_pressed = False
+        if kb_presses:
+            kpress, ktime = kb_presses[0]
+            if kpress == 'q' or kpress == 'escape':
+                self.end_experiment(False)
+            # response keys are scored by the precomputed table of the trial
+            score = trial.scores.get(kpress)
+            if score is not None:
+                answ, answer = score
+                cumulative_result = self.cumulative_result
+                if answer == constant.ANSWER_CORRECT:
+                    cumulative_result.correct_count += 1
+                else:
+                    cumulative_result.incorrect_count += 1
+                if self.test_mode:
+                    diff_time = ktime-stime
+                    raw_response = None
+                    # key pressing was done too quick. We don't consider such key overflow
+                    if diff_time*1000 < self.parameters['too_fast_time']:
+                        raw_response = (answ, answer, diff_time)
+                        cumulative_result.timeout_too_fast_count += 1
+                        if answer == constant.ANSWER_CORRECT:
+                            cumulative_result.correct_count -= 1
+                        if answer == constant.ANSWER_INCORRECT:
+                            cumulative_result.incorrect_count -= 1
+                        answ = constant.STIMULI_NO_ANSWER
+                        answer = constant.ANSWER_INCORRECT
+                        diff_time = 0.0
+                    if answer == constant.ANSWER_CORRECT:
+                        cumulative_result.add_correct_time(diff_time)
+                    self.write_trial_row(count, trial.label, trial.stimulus.color, answ, answer, diff_time, stime,
+                                         onset_jitter, raw_response)
+                key_pressed = True
+        return key_pressed
+
+    def instruct_pic_wait(self, trial, count, cross_onset):
+        """Displays graphical stimuli and waits for key input for the planned number of frames.
+        :param trial: c_result.Trial with the graphical stimuli elements to display (e.g. flower and cross)
+        :param count: current stimuli index (beginning with 0)
+        :param cross_onset: flip time stamp of the fixation cross preceding the stimuli
+        """
+        timeline = self.timeline
+        self.device_reader.arm()
+        # flip time stamps and key events share one monotonic clock; the flip is the reaction time origin.
+        # The trial screen is composed by the stimulus cache
+        onset_time = timeline.show(trial.stimulus.elements)
+        onset_jitter = onset_time - timeline.get_intended_onset(cross_onset)
+        # the stimulus is held by one flip per frame, queued key events are processed after each flip
+        frames = 0
+        try:
+            while True:
+                kb_presses = self.device_reader.get(0)
+                if self.process_key_pressed(kb_presses, trial, onset_time, count, onset_jitter):
+                    react_time = kb_presses[0][1] - onset_time
+                    break
+                if frames >= timeline.response_frames:
+                    # timeout waiting for key event
+                    react_time = self.clock.getTime() - onset_time
+                    if self.test_mode:
+                        self.cumulative_result.timeout_too_fast_count += 1
+                        self.write_trial_row(count, trial.label, trial.stimulus.color, constant.STIMULI_NO_ANSWER,
+                                             constant.STIMULI_NO_ANSWER, react_time, onset_time, onset_jitter)
+                    break
+                timeline.show(trial.stimulus.elements)
+                frames += 1
+        finally:
+            self.device_reader.disarm()
+            if self.frame_timer is not None:
+                self.frame_timer.stop()
+        if self.test_mode:
+            # frames dropped during fixation, onset and response hold, from the flip intervals of the trial
+            self.cumulative_result.dropped_frame_count += timeline.dropped_frames
+            if self.frame_timer is not None:
+                self.frame_timer.add_onset(onset_jitter, timeline.dropped_frames)
+            self.report_worker.submit(self.timeline_store.append, count, timeline, onset_time - cross_onset, frames,
+                                      react_time)
+
+    def execute_test_step(self, dialog_text, step, stimuli, tested_field_name):
+        """Carries out test step.
+        :param dialog_text: text to display in the dialog
+        :param step: step number
+        :param stimuli: list of c_result.Trial of the step
+        :param tested_field_name: filed name varying between experiments, e.g. 'pos' for dotmixed
+        :return: c_result.Result of the step
+        """
+        self.show_dialog(dialog_text)
+        self.cumulative_result.reset()
+        self.report_worker.submit(c_file.write_step_header, step, self.data_file, tested_field_name)
+        self.report_worker.submit(self.data_file.sync)
+        self.report_worker.submit(self.trial_store.begin_step, step)
+        self.report_worker.submit(self.timeline_store.begin_step, step)
+        self.do_stimuli_execution(None, stimuli)
+        self.report_worker.submit(c_file.write_footer, self.data_file, self.cumulative_result.correct_count,
+                                  len(stimuli), self.cumulative_result.dropped_frame_count)
+        self.report_worker.submit(self.data_file.sync)
+        self.report_worker.submit(self.trial_store.save)
+        self.report_worker.submit(self.timeline_store.save)
+        return c_result.build_result(self.cumulative_result, len(stimuli))
+
+    def start_report(self):
+        """Opens single report file, structured trial store and timeline store of the session. The session plan is
+        saved next to the report, so the session can be repeated from it."""
+        parameters = self.parameters
+        self.test_mode = True
+        self.data_file = self.report_worker.submit(c_file.init_file, self.version, self.author,
+                                                   parameters['SubjectID'], parameters['DataPath'], self.device,
+                                                   parameters['FilePrefix'], parameters['HeaderStaff'],
+                                                   self.plan['plan_id']).result()
+        self.trial_store = c_store.TrialStore(c_store.get_store_path(self.data_file.path), parameters['SubjectID'])
+        self.timeline_store = c_timeline.TimelineStore(c_timeline.get_timeline_path(self.data_file.path))
+        self.report_worker.submit(c_plan.save_plan, self.plan, c_plan.get_report_plan_path(self.data_file.path))
+
+    def run(self, block_trials, cross_screen, subject_id=None):
+        """Runs all plan blocks of one participant and writes the reports. Only per-participant state is reset, so a
+        session can run any number of participants in turn (kiosk mode). The single report file is closed at the
+        end; the report worker keeps running.
+        :param block_trials: list of c_result.Trial lists, one per plan block, see c_plan.get_block_trials
+        :param cross_screen: fixation cross elements, drawn without positions
+        :param subject_id: proband id or 'None' to ask for it
+        :return: dictionary step -> c_result.Result
+        """
+        parameters = self.parameters
+        self.test_mode = False
+        self.cumulative_result = c_result.CumulativeResult()
+        self.cross_screen = cross_screen
+        # durations of the plan as frame counts of the measured refresh period
+        self.timeline = c_timeline.TimelineScheduler(self.exp_win, self.frame_period, parameters['blank_duration'],
+                                                     parameters['FixDur'])
+        if self.frame_timer is not None:
+            self.frame_timer.reset()
+        self.show_dialog('Experiment mit ' + self.device)
+        if subject_id is None:
+            # keys pressed during the previous session are not taken as input
+            self.event.clearEvents()
+            subject_id = c_inputscreen.get_proband_id(parameters, self.exp_win)
+            if not subject_id:
+                # input terminated by escape key
+                self.end_experiment(False)
+        parameters['SubjectID'] = subject_id
+
+        step_results = {}
+        for block, trials in zip(self.plan['blocks'], block_trials):
+            if block['step'] is None:
+                self.do_stimuli_execution(block['dialog'], trials)
+                continue
+            if not self.test_mode:
+                self.start_report()
+            step_results[block['step']] = self.execute_test_step(block['dialog'], block['step'], trials,
+                                                                 block['field'])
+        analysis_steps = c_plan.LAYOUTS[self.plan['paradigm']]['analysis']
+        congruent, incongruent, mixed = [step_results.get(step) for step in analysis_steps]
+        self.report_worker.submit(c_file.write_analysis, self.data_file, congruent, incongruent, mixed,
+                                  parameters['DataPath'], subject_id,
+                                  "_" + parameters['FilePrefix'] + constant.REPORT_FILE_NAME)
+        if self.frame_timer is not None:
+            self.report_worker.submit(c_file.write_timing_summary, self.data_file.path,
+                                      self.frame_timer.get_summary())
+        self.show_dialog('Experiment beendet. Vielen Dank!')
+        self.report_worker.submit(self.data_file.close)
+        self.data_file = None
+        return step_results
@@ -4,21 +4,138 @@
 
 from __future__ import absolute_import, division, print_function
 
+import glob
+import io
+import json
 import os
 
 import platform
 import sys
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from psychopy import __version__
+import constant
 
 pathname = os.path.dirname(sys.argv[0])
 RunPath = os.path.abspath(pathname)
 
 
-def init_file(version, author, subject_id, data_path, device, prefix, staff):
+class ReportWriter:
+    """Single report file, which collects rows in memory and writes them in the blank interval between trials.
+    The file is written as '<name>.txt.part' and renamed to '<name>.txt' on close, so a session terminated by
+    a crash can be recognized and recovered on the next start."""
+    def __init__(self, path):
+        self.path = path
+        self.partial_path = path + constant.PARTIAL_FILE_SUFFIX
+        self._file = open(self.partial_path, 'w')
+        self._rows = []
+
+    @property
+    def closed(self):
+        """'True', if the report file has been closed"""
+        return self._file.closed
+
+    def write(self, text):
+        """Collects text in memory.
+        :param text: text to write
+        """
+        self._rows.append(text)
+
+    def flush(self):
+        """Writes collected text to the file."""
+        if self._rows:
+            self._file.write(''.join(self._rows))
+            self._rows.clear()
+        self._file.flush()
+
+    def sync(self):
+        """Writes collected text and forces it to disk. Used at step boundaries."""
+        self.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Writes collected text, closes the file and renames it to its final name."""
+        if self.closed:
+            return
+        self.sync()
+        self._file.close()
+        os.replace(self.partial_path, self.path)
+
+
+class ReportWorker:
+    """Single writer thread, which carries out all report file I/O in order of submission. The trial loop only
+    enqueues calls of the c_file functions; shutdown() drains the queue before exit."""
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ReportWorker')
+        self._errors = []
+
+    def submit(self, function, *args):
+        """Enqueues file I/O.
+        :param function: function to carry out on the writer thread, e.g. c_file.write_stimuli_row
+        :param args: function arguments
+        :return: concurrent.futures.Future of the function result
+        """
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(self._check_result)
+        return future
+
+    def _check_result(self, future):
+        error = future.exception()
+        if error is not None:
+            print('report I/O failed:', error)
+            self._errors.append(error)
+
+    def drain(self):
+        """Waits until all enqueued file I/O is carried out. Re-raises the first failure."""
+        self._executor.submit(lambda: None).result()
+        if self._errors:
+            error = self._errors[0]
+            self._errors.clear()
+            raise error
+
+    def shutdown(self):
+        """Drains the queue and terminates the writer thread."""
+        try:
+            self.drain()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+def recover_partial_files(data_path):
+    """
+    Recovers single report files left behind by a terminated session of this host. The collected rows of such a
+    session have been written up to the last flush; the file gets a note and its final '.txt' name.
+    :param data_path: data directory name, relative to current execution path
+    :return: list of recovered report files
     """
-    Creates and initializes single report file.
+    recovered = []
+    for partial_path in glob.glob(get_file(data_path, '*_' + platform.node() + '.txt' + constant.PARTIAL_FILE_SUFFIX)):
+        path = partial_path[:-len(constant.PARTIAL_FILE_SUFFIX)]
+        if os.path.exists(path):
+            path = os.path.splitext(path)[0] + '_recovered.txt'
+        with open(partial_path, 'a') as file:
+            file.write('\n\n recovered: session was terminated unexpectedly\n')
+        os.replace(partial_path, path)
+        recovered.append(path)
+    return recovered
+
+
+def get_psychopy_version():
+    """
+    Gets installed PsychoPy version from the package metadata, PsychoPy itself is not imported
+    :return: version string or 'unknown'
+    """
+    from importlib import metadata
+    try:
+        return metadata.version('psychopy')
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def init_file(version, author, subject_id, data_path, device, prefix, staff, plan_id=None):
+    """
+    Creates and initializes single report file. Report files of terminated sessions are recovered first.
     :param version: application version
     :param author: experiment author
     :param subject_id: proband id
@@ -26,21 +143,28 @@ def init_file(version, author, subject_id, data_path, device, prefix, staff):
     :param device: current device
     :param prefix: report file prefix
     :param staff: header staff description
+    :param plan_id: id of the session plan or 'None'
+    :return: ReportWriter
     """
 
     # create directory if it doesn't exist
     if not os.path.exists(get_file(data_path, '')):
         os.makedirs(get_file(data_path, ''))
+    for path in recover_partial_files(data_path):
+        print('recovered report file', path)
 
     date_str = time.strftime("%Y%m%d_%H%M", time.localtime())  # add the current time
     file_name = prefix + '_' + subject_id + '_' + date_str + '_' + platform.node()
-    file = open(os.path.join(RunPath, data_path, file_name + '.txt'), 'w')
+    file = ReportWriter(os.path.join(RunPath, data_path, file_name + '.txt'))
     file.write('File: %s\n' % file_name)
     file.write('SourceCode: %s, %s, %s\n' % (__file__, version, author))
     file.write('Host: %s, OS: %s, Python: %s, PsychoPy: %s\n' % (platform.node(), platform.platform(terse=0),
-                                                                 platform.python_version(), __version__))
+                                                                 platform.python_version(), get_psychopy_version()))
     file.write('Response device:\t' + device + '\n')
     file.write('Staff:\t\t\t' + staff + '\n')
+    if plan_id is not None:
+        file.write('Plan:\t\t\t' + plan_id + '\n')
+    file.sync()
     return file
 
 
@@ -53,7 +177,7 @@ def write_step_header(step, data_file, tested_field_name):
     """
     if step != 0:
         data_file.write("\n\n\t\t\tStep " + str(step) + "\n")
-    data_file.write("\ntrial\t" + tested_field_name + "\tcolor\tansw\teval\tRT(ms)\t\tRT-right-cum(ms)")
+    data_file.write("\ntrial\t" + tested_field_name + "\tcolor\tansw\teval\tRT(ms)\t\tRT-right-cum(ms)\tjitter(ms)")
 
 
 def write_congruent_analysis(file, congruent, subject_id, formatting_tab):
@@ -66,8 +190,8 @@ def write_congruent_analysis(file, congruent, subject_id, formatting_tab):
     This parameter is empty for general report
     """
     file.write("\n" + subject_id + "\t" + str(congruent.x_r) + "\t{:.0f}".format(congruent.x_r_quote))
-    file.write(formatting_tab + "\t{:.0f}".format(congruent.x_r_rt_mean))
-    file.write(formatting_tab + "\t{:.0f}".format(congruent.xr_rt_median))
+    file.write(formatting_tab + "\t{:.3f}".format(congruent.x_r_rt_mean))
+    file.write(formatting_tab + "\t{:.3f}".format(congruent.xr_rt_median))
     file.write(formatting_tab + "\t" + str(congruent.x_w) + "\t" + str(congruent.x_err))
 
 
@@ -80,8 +204,8 @@ def write_result_analysis(file, result_class, formatting_tab):
     This parameter empty for general report
     """
     file.write("\t" + str(result_class.x_r) + "\t{:.0f}".format(result_class.x_r_quote))
-    file.write(formatting_tab + "\t{:.0f}".format(result_class.x_r_rt_mean))
-    file.write(formatting_tab + "\t{:.0f}".format(result_class.xr_rt_median))
+    file.write(formatting_tab + "\t{:.3f}".format(result_class.x_r_rt_mean))
+    file.write(formatting_tab + "\t{:.3f}".format(result_class.xr_rt_median))
     file.write(formatting_tab + "\t" + str(result_class.x_w) + "\t" + str(result_class.x_err))
 
 
@@ -106,15 +230,27 @@ def write_analysis_header_mixed(file, prefix):
     file.write("\tm_r\tm_r_quote\tm_r_rt_mean\tm_r_rt_median\tm_w\tm_err")
 
 
-def write_footer(data_file, correct_count, no_repetitions):
+def write_footer(data_file, correct_count, no_repetitions, dropped_frame_count=0):
     """
     Writes footer for single report step
     :param data_file: file to write the footer into
     :param correct_count: number of correct answers for the step
     :param no_repetitions: number of stimuli in step
+    :param dropped_frame_count: number of frames dropped in the trial windows (fixation, onset and response)
     """
     data_file.write("\n\n right answers: " + str(correct_count))
     data_file.write("\n wrong answers/no answer: " + str(no_repetitions - correct_count))
+    data_file.write("\n dropped frames: " + str(dropped_frame_count))
+
+
+def write_timing_summary(report_path, summary):
+    """
+    Writes frame timing summary of a session next to its single report file
+    :param report_path: single report file path
+    :param summary: timing summary, see c_visual.FrameTimer.get_summary
+    """
+    write_atomic(os.path.splitext(report_path)[0] + constant.TIMING_SUMMARY_SUFFIX,
+                 json.dumps(summary, indent=1, sort_keys=True))
 
 
 def get_file(data_path, report_fie_name):
@@ -127,6 +263,145 @@ def get_file(data_path, report_fie_name):
     return os.path.join(RunPath, data_path, report_fie_name)
 
 
+def write_atomic(path, text, mode='w'):
+    """
+    Writes file content atomically, i.e. readers see either the old or the new content
+    :param path: file path
+    :param text: file content, bytes for binary mode
+    :param mode: 'w' for text or 'wb' for binary files
+    """
+    temp_path = '%s.%s_%d.tmp' % (path, platform.node(), os.getpid())
+    with open(temp_path, mode) as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def get_fragment_dir(data_path, report_fie_name):
+    """
+    Gets directory of the per-session fragments of a general analysis report
+    :param data_path: data directory name, relative to current execution path
+    :param report_fie_name: file name of the general analysis report
+    :return: fragment directory path
+    """
+    return get_file(data_path, report_fie_name + constant.FRAGMENT_DIR_SUFFIX)
+
+
+def write_analysis_fragment(data_path, report_fie_name, proband_id, row):
+    """
+    Writes general analysis report row of a single session into its own fragment file. Fragment files never
+    collide between testing stations, so no rows get lost or duplicated on a shared directory.
+    :param data_path: data directory name, relative to current execution path
+    :param report_fie_name: file name of the general analysis report
+    :param proband_id: proband id
+    :param row: report row, beginning with a new line
+    """
+    fragment_dir = get_fragment_dir(data_path, report_fie_name)
+    os.makedirs(fragment_dir, exist_ok=True)
+    fragment_name = '%s_%s_%s_%d.txt' % (time.strftime("%Y%m%d_%H%M%S", time.localtime()), proband_id,
+                                         platform.node(), os.getpid())
+    write_atomic(os.path.join(fragment_dir, fragment_name), row)
+
+
+def read_lock_owner(lock_path):
+    """
+    Reads owner token of a lock file
+    :param lock_path: lock file path
+    :return: owner token or 'None', if there is no lock file
+    """
+    try:
+        with open(lock_path, 'r') as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def acquire_lock(lock_path):
+    """
+    Acquires lock file, which contains the owner token of this process. A lock, whose owner token stays unchanged
+    for constant.LOCK_STALE_TIME on the local clock, is considered stale and removed. The clocks of other stations
+    and of the share are not compared, so clock skew can't break a live lock.
+    :param lock_path: lock file path
+    :return: owner token, if the lock was acquired within constant.LOCK_TIMEOUT, otherwise 'None'
+    """
+    token = '%s_%d_%s' % (platform.node(), os.getpid(), uuid.uuid4().hex)
+    deadline = time.monotonic() + constant.LOCK_TIMEOUT
+    observed_owner = None
+    observed_time = None
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            with os.fdopen(fd, 'w') as file:
+                file.write(token)
+            return token
+        except FileExistsError:
+            owner = read_lock_owner(lock_path)
+            if owner != observed_owner or observed_time is None:
+                observed_owner = owner
+                observed_time = time.monotonic()
+            elif owner is not None and time.monotonic() - observed_time > constant.LOCK_STALE_TIME:
+                release_lock(lock_path, owner)
+                observed_time = None
+                continue
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(constant.LOCK_RETRY_TIME)
+
+
+def release_lock(lock_path, token):
+    """
+    Removes lock file, if it is still owned by the provided owner token
+    :param lock_path: lock file path
+    :param token: owner token returned by acquire_lock
+    """
+    if read_lock_owner(lock_path) == token:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def merge_analysis_fragments(data_path, report_fie_name):
+    """
+    Rebuilds general analysis report from its fragment files. The merge reads all fragments of the cohort, so it
+    is carried out on demand (c_reanalysis.py --merge), not by the sessions. Rows, which were appended to the
+    report before fragments were introduced, are kept in a legacy fragment on the first merge. The merge is
+    serialized by a lock file and the report is replaced atomically.
+    :param data_path: data directory name, relative to current execution path
+    :param report_fie_name: file name of the general analysis report
+    :return: 'True', if the report was rebuilt, 'False', if the lock could not be acquired
+    """
+    fragment_dir = get_fragment_dir(data_path, report_fie_name)
+    os.makedirs(fragment_dir, exist_ok=True)
+    report_path = get_file(data_path, report_fie_name)
+    lock_path = report_path + constant.LOCK_FILE_SUFFIX
+    token = acquire_lock(lock_path)
+    if token is None:
+        print('general analysis report is locked, merge skipped:', report_path)
+        return False
+    try:
+        legacy_path = os.path.join(fragment_dir, constant.LEGACY_FRAGMENT_NAME)
+        if not os.path.exists(legacy_path):
+            rows = ''
+            if os.path.isfile(report_path):
+                with open(report_path, 'r') as file:
+                    content = file.read()
+                if '\n' in content:
+                    rows = content[content.index('\n'):]
+            write_atomic(legacy_path, rows)
+        report = io.StringIO()
+        write_analysis_header_mixed(report, "")
+        for fragment_name in sorted(os.listdir(fragment_dir)):
+            if fragment_name.endswith('.txt'):
+                with open(os.path.join(fragment_dir, fragment_name), 'r') as file:
+                    report.write(file.read())
+        write_atomic(report_path, report.getvalue())
+    finally:
+        release_lock(lock_path, token)
+    return True
+
+
 def write_analysis(data_file, congruent, incongruent, mixed, data_path, proband_id, report_fie_name):
     """
     Writes single report and general analysis report rows
@@ -139,13 +414,8 @@ def write_analysis(data_file, congruent, incongruent, mixed, data_path, proband_
     :param report_fie_name: file name of the general analysis report
     """
     write_analysis_header_mixed(data_file, "\n\n")
-    if not os.path.isfile(get_file(data_path, report_fie_name)):
-        # create the general analysis report, if it doesn't exist
-        data_file_all = open(get_file(data_path, report_fie_name), 'w')
-        write_analysis_header_mixed(data_file_all, "")
-    else:
-        # open the general analysis report for appending, if it exists
-        data_file_all = open(get_file(data_path, report_fie_name), 'a+')
+    # the general analysis report row is written as session fragment, the report is merged on demand
+    data_file_all = io.StringIO()
     if congruent is not None:
         write_congruent_analysis(data_file, congruent, proband_id, '\t')
         write_congruent_analysis(data_file_all, congruent, proband_id, '')
@@ -158,10 +428,10 @@ def write_analysis(data_file, congruent, incongruent, mixed, data_path, proband_
     if congruent is None and incongruent is None:
         data_file_all.write("\n" + proband_id)
     write_result_analysis(data_file_all, mixed, '')
-    data_file_all.close()
+    write_analysis_fragment(data_path, report_fie_name, proband_id, data_file_all.getvalue())
 
 
-def write_stimuli_row(data_file, count, pos, color, answer, correctness, diff_time, cumulative_time):
+def write_stimuli_row(data_file, count, pos, color, answer, correctness, diff_time, cumulative_time, onset_jitter):
     """
    Writes single step report row
    :param data_file: single report file to write row into
@@ -170,9 +440,10 @@ def write_stimuli_row(data_file, count, pos, color, answer, correctness, diff_ti
    :param color: currently 'red' or 'blue'
    :param answer: proband answer. ('L' or 'R')
    :param correctness: correctness of the answer. '0' for 'False' and '1' for 'True'
-   :param diff_time: reaction time
-   :param cumulative_time: cumulative time of correct answers for current step
+   :param diff_time: reaction time in seconds, written in ms with microsecond precision
+   :param cumulative_time: cumulative time of correct answers for current step in seconds
+   :param onset_jitter: difference between actual and intended stimulus onset in seconds
    """
     data_file.write("\n" + str(count+1) + "\t" + pos + "\t" + color + "\t" +
-                    answer + "\t" + correctness + "\t{:.0f}".format(diff_time * 1000) +
-                    "\t\t{:.0f}".format(cumulative_time * 1000))
+                    answer + "\t" + correctness + "\t{:.3f}".format(diff_time * 1000) +
+                    "\t\t{:.3f}".format(cumulative_time * 1000) + "\t{:.3f}".format(onset_jitter * 1000))
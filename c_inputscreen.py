@@ -3,7 +3,7 @@
 """ Class c_inputscreen - to handle text input from psychoPy screen
 Based on Thomas' initial implementation"""
 
-from psychopy import visual, event
+import c_visual
 
 class InputScreenHandler:
     """Class to handle text input from psychopy screen """
@@ -51,6 +51,7 @@ class InputScreenHandler:
         self._TextInput = ''
         self.KeyTerminate = ''
         self.OK = False
+        from psychopy import visual
         self._InputInfoText = visual.TextStim(screen_win, text=input_info_str, pos=input_info_pos, units=units,
                                               height=height, color=color, font=font, bold=bold, italic=italic)
         self._InputText = visual.TextStim(screen_win, text='', pos=input_text_pos, units=units, height=height,
@@ -59,6 +60,7 @@ class InputScreenHandler:
                                             color=color, font=font, bold=bold, italic=italic)
 
     def get_input(self):
+        from psychopy import event
         self._InputInfoText.draw()
         self._ScreenWin.flip()
         self.KeyTerminate = ''
@@ -66,7 +68,7 @@ class InputScreenHandler:
         wait_for_input = True
         shift_flag = False
         while wait_for_input:
-            for keys in event.getKeys(keyList=None):
+            for keys in c_visual.wait_keys(event):
                 if keys in self.KeyQuit:
                     self.KeyTerminate = keys
                     self._TextInput = ''
@@ -0,0 +1,214 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Paradigm engine shared by the experiment scripts. A paradigm is described by data only: its plan layout
+(c_plan.LAYOUTS: stimuli, key rule, blocks) and its presentation (PRESENTATIONS: image per stimulus, further
+elements and element positions per side). compile_trials turns the description and a session plan into the trial
+table of the session, one c_result.Trial per plan cell with its composite screen and precomputed scoring table,
+which c_experiment_core.ExperimentSession presents (cross, stimulus, response or timeout) without any paradigm
+specific branching."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+
+import c_device
+import c_experiment_core
+import c_file
+import c_plan
+import c_result
+import c_startup
+import c_stimcache
+import c_timeline
+import c_visual
+import constant
+
+# fixation cross elements, registered with the stimulus cache of the runtime
+CROSS_ELEMENTS = ('cross_line_1', 'cross_line_2')
+
+
+def get_side_positions(parameters):
+    """Gets element positions of stimuli shown left or right of the midline (image, then cross lines).
+    :param parameters: experiment parameters
+    :return: dictionary side -> elements positions
+    """
+    return {constant.STIMULI_IMAGE_POSITION_LEFT: ((-1 * parameters['DotX'], 0),
+                                                   (-1 * parameters['DotX'], parameters['ArrowY']), (0, 0), (0, 0)),
+            constant.STIMULI_IMAGE_POSITION_RIGHT: ((parameters['DotX'], 0),
+                                                    (parameters['DotX'], parameters['ArrowY']), (0, 0), (0, 0))}
+
+
+def get_centred_positions(parameters):
+    """Gets element positions of centred stimuli.
+    :param parameters: experiment parameters
+    :return: dictionary side -> elements positions
+    """
+    return {constant.STIMULI_IMAGE_POSITION_CENTRE: ((0, 0), (0, 0), (0, 0), (0, 0))}
+
+
+# paradigm presentations: parameter with the image files, image file index per stimulus id, elements shown with
+# the image and the element positions per side
+PRESENTATIONS = {
+    'Dots': {
+        'files': 'DotFile',
+        'images': {'red': 0, 'blue': 1},
+        'elements': CROSS_ELEMENTS,
+        'positions': get_side_positions,
+    },
+    'Flanker': {
+        'files': 'FlankerFile',
+        'images': {'blue_congr': 0, 'blue_incongr': 1, 'red_congr': 2, 'red_incongr': 3},
+        'elements': (),
+        'positions': get_centred_positions,
+    },
+}
+
+
+def get_stimuli(paradigm, parameters):
+    """Gets stimuli of a paradigm, elements given by name of the cached elements.
+    :param paradigm: paradigm name in c_plan.LAYOUTS and PRESENTATIONS
+    :param parameters: experiment parameters
+    :return: dictionary stimulus id -> c_result.Stimulus
+    """
+    presentation = PRESENTATIONS[paradigm]
+    files = parameters[presentation['files']]
+    stimuli = {}
+    for stimulus_id, (color, congruent) in c_plan.LAYOUTS[paradigm]['stimuli'].items():
+        elements = (files[presentation['images'][stimulus_id]],) + presentation['elements']
+        stimuli[stimulus_id] = c_result.Stimulus(stimulus_id, elements, color, congruent)
+    return stimuli
+
+
+def compile_trials(paradigm, parameters, plan, stim_cache):
+    """Compiles paradigm description and session plan into the trial table of the session. All screens are
+    composed and drawn once before the first trial.
+    :param paradigm: paradigm name in c_plan.LAYOUTS and PRESENTATIONS
+    :param parameters: experiment parameters
+    :param plan: session plan of the paradigm
+    :param stim_cache: c_stimcache.StimulusCache
+    :return: list of c_result.Trial lists, one per plan block, and the fixation cross screen
+    """
+    cross_screen = stim_cache.get_screen(CROSS_ELEMENTS, ((parameters['ArrowY']), (0, 0), (0, 0)))
+    block_trials = c_plan.get_block_trials(plan, get_stimuli(paradigm, parameters),
+                                           PRESENTATIONS[paradigm]['positions'](parameters), stim_cache)
+    stim_cache.warm_up()
+    return block_trials, cross_screen
+
+
+class Runtime:
+    """Window, response device, stimulus cache and report worker of the process, shared by all sessions. The
+    MilliKey device is probed while PsychoPy is loaded and the window is created."""
+    def __init__(self, parameters, startup_timer=None):
+        startup_timer = c_startup.StartupTimer() if startup_timer is None else startup_timer
+        # MilliKey discovery and connection run while PsychoPy is loaded and the window is created
+        device_probe = c_startup.start_device_probe(os.path.join(c_file.RunPath, constant.MILLI_KEY_STATE_FILE),
+                                                    parameters['MilliKeyPort'], startup_timer)
+        screen_size = c_startup.get_screen_size()
+        if screen_size is not None:
+            parameters['ScreenSize'] = screen_size
+            parameters['FullScr'] = True
+        else:
+            print('Full screen mode not available')
+        startup_timer.mark('screen size')
+
+        from psychopy import core, event
+        startup_timer.mark('psychopy import')
+        self.core = core
+        self.event = event
+        self.clock = core.monotonicClock  # clock of flip time stamps, key events and reaction times
+
+        # visual stimuli
+        self.exp_win = c_visual.get_exp_win(parameters)
+        startup_timer.mark('window')
+        # refresh period measured once, durations are presented as frame counts of it
+        self.frame_period = c_timeline.measure_frame_period(self.exp_win)
+        startup_timer.mark('refresh measurement')
+        # optional flip interval recording
+        self.frame_timer = None
+        if parameters['FrameTiming']:
+            self.frame_timer = c_visual.FrameTimer(self.exp_win, self.frame_period)
+            self.frame_timer.install()
+        self.instruct_text = c_visual.get_instruct_text(self.exp_win, parameters)
+        # stimuli images (decoded once), positioned stimulus instances and composite screens
+        self.stim_cache = c_stimcache.StimulusCache(self.exp_win, os.path.join(c_file.RunPath, parameters['PicPath']))
+        self.stim_cache.register(CROSS_ELEMENTS[0], lambda: c_visual.get_cross_line_1(self.exp_win, parameters))
+        self.stim_cache.register(CROSS_ELEMENTS[1], lambda: c_visual.get_cross_line_2(self.exp_win, parameters))
+        startup_timer.mark('stimuli')
+
+        # we have multi device implementation (KEYBOARD, if no MilliKey device is available)
+        self.device, self.mk_connection = device_probe.result()  # kept open for the whole run
+        startup_timer.mark('device probe wait')
+
+        # writer thread for all report file I/O
+        self.report_worker = c_file.ReportWorker()
+        # reader thread for key events time stamped by the keyboard queue (MilliKey keys arrive as key presses)
+        self.device_reader = c_device.DeviceReader(self.device, c_device.KeyboardQueue(self.clock),
+                                                   parameters['KeyCode'], parameters['device_poll_interval'])
+        self.device_reader.start()
+        startup_timer.mark('device reader')
+        self.startup_timer = startup_timer
+
+    def create_session(self, parameters, plan, version, author):
+        """Creates session of a paradigm on this runtime.
+        :param parameters: experiment parameters of the paradigm
+        :param plan: session plan
+        :param version: application version written into the report header
+        :param author: experiment author written into the report header
+        :return: c_experiment_core.ExperimentSession
+        """
+        return c_experiment_core.ExperimentSession(parameters, plan, self.exp_win, self.event, self.clock,
+                                                   self.device, self.device_reader, self.stim_cache,
+                                                   self.report_worker, self.instruct_text, self.mk_connection,
+                                                   self.frame_timer, self.core.quit, version, author,
+                                                   self.frame_period)
+
+
+def run_battery(tasks, parameters, version, author):
+    """Runs tasks one after another in one process. Window, textures, device connection and report worker are
+    shared, the proband id is asked once per participant and all trial tables are compiled before the first task.
+    Each task writes its reports into its own data directory.
+    :param tasks: sequence of (paradigm name, task parameters), e.g. the parameters of the task scripts
+    :param parameters: parameters overriding the task parameters (e.g. 'Kiosk') or 'None'
+    :param version: application version
+    :param author: experiment author
+    """
+    startup_timer = c_startup.StartupTimer()
+    paradigms = [paradigm for paradigm, _ in tasks]
+    task_parameters = []
+    for _, task in tasks:
+        task = dict(task)
+        task.update(parameters or {})
+        task_parameters.append(task)
+    # block order, trial orders and durations of the sessions
+    plans = [c_plan.get_session_plan(paradigm, task) for paradigm, task in zip(paradigms, task_parameters)]
+    startup_timer.mark('session plans')
+    runtime = Runtime(task_parameters[0], startup_timer)
+    sessions = [runtime.create_session(task, plan, version, author) for task, plan in zip(task_parameters, plans)]
+    kiosk = task_parameters[0]['Kiosk']
+    if task_parameters[0]['StartupTiming']:
+        startup_timer.report()
+
+    while True:
+        compiled_tasks = [compile_trials(paradigm, session.parameters, session.plan, runtime.stim_cache)
+                          for paradigm, session in zip(paradigms, sessions)]
+        subject_id = None if kiosk else sessions[0].plan['subject_id']
+        for session, (block_trials, cross_screen) in zip(sessions, compiled_tasks):
+            session.run(block_trials, cross_screen, subject_id)
+            subject_id = session.parameters['SubjectID']
+        if not kiosk:
+            sessions[-1].end_experiment(True)
+        # kiosk mode: window, device session and decoded stimuli stay ready, the next participant gets new plans
+        for paradigm, session in zip(paradigms, sessions):
+            session.plan = c_plan.get_session_plan(paradigm, session.parameters)
+
+
+def main(paradigm, parameters, version, author):
+    """Runs experiment script: one participant or, in kiosk mode, one participant after another.
+    :param paradigm: paradigm name in c_plan.LAYOUTS and PRESENTATIONS
+    :param parameters: experiment parameters of the script
+    :param version: application version
+    :param author: experiment author
+    """
+    if len(sys.argv) > 1:
+        parameters['PlanFile'] = sys.argv[1]
+    run_battery(((paradigm, parameters),), None, version, author)
@@ -0,0 +1,246 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Session plans. A plan holds the block order, the trial descriptors of every block, the durations and the seed of
+one session, so the presentation loop only iterates it. Plans are created at startup or generated offline for a
+whole cohort and loaded by plan file.
+
+Usage: python c_plan.py {Dots,Flanker} SUBJECT_ID [SUBJECT_ID ...] [--seed SEED] [--output-dir DIR]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+
+import numpy
+
+import c_file
+import c_result
+import c_sequence
+import constant
+
+RIGHT = constant.STIMULI_IMAGE_POSITION_RIGHT
+LEFT = constant.STIMULI_IMAGE_POSITION_LEFT
+CENTRE = constant.STIMULI_IMAGE_POSITION_CENTRE
+
+
+def get_dots_expected_key(color, side):
+    """Gets key expected as correct answer for dots: the side of the red heart, the opposite side of the blue flower.
+    :param color: stimulus color
+    :param side: stimuli element position (left or right)
+    :return: LEFT_KEYCODE or RIGHT_KEYCODE
+    """
+    if (side == constant.STIMULI_IMAGE_POSITION_RIGHT) == (color == constant.CONGRUENT_COLOR):
+        return constant.RIGHT_KEYCODE
+    return constant.LEFT_KEYCODE
+
+
+def get_flanker_expected_key(color, side):
+    """Gets key expected as correct answer for flanker: right for red, left for blue stimuli.
+    :param color: stimulus color
+    :param side: stimuli element position, not considered for centred stimuli
+    :return: LEFT_KEYCODE or RIGHT_KEYCODE
+    """
+    if color == constant.CONGRUENT_COLOR:
+        return constant.RIGHT_KEYCODE
+    return constant.LEFT_KEYCODE
+
+
+# paradigm layouts: stimulus id -> (color, congruent), the key rule, the reported label ('side' or 'congruency')
+# the test steps reported as congruent, incongruent and mixed results ('None' if not tested)
+# and the blocks with dialog text, test step ('None' for practice), tested field name, repetitions parameter
+# and cells as (stimulus id, side)
+LAYOUTS = {
+    'Dots': {
+        'stimuli': {'red': (constant.CONGRUENT_COLOR, True), 'blue': (constant.UNCONGRUENT_COLOR, False)},
+        'key_rule': get_dots_expected_key,
+        'label': 'side',
+        'analysis': (1, 2, 3),
+        'blocks': (
+            ('Übung rotes Herz', None, None, 'no_probe_repetitions', (('red', RIGHT), ('red', LEFT))),
+            ('Übung blaue Blume', None, None, 'no_probe_repetitions', (('blue', RIGHT), ('blue', LEFT))),
+            ('Übung Herz/Blume gemischt', None, None, 'NoRepetitions',
+             (('red', RIGHT), ('red', LEFT), ('blue', LEFT), ('blue', RIGHT))),
+            ('Test Herz', 1, 'pos', 'NoRepetitionsTest', (('red', RIGHT), ('red', LEFT))),
+            ('Test Blume', 2, 'pos', 'NoRepetitionsTest', (('blue', RIGHT), ('blue', LEFT))),
+            ('Test Herz/Blume', 3, 'pos', 'NoRepetitionsTest',
+             (('red', RIGHT), ('red', LEFT), ('blue', LEFT), ('blue', RIGHT))),
+        ),
+    },
+    'Flanker': {
+        'stimuli': {'blue_congr': (constant.UNCONGRUENT_COLOR, True), 'red_congr': (constant.CONGRUENT_COLOR, True),
+                    'blue_incongr': (constant.UNCONGRUENT_COLOR, False),
+                    'red_incongr': (constant.CONGRUENT_COLOR, False)},
+        'key_rule': get_flanker_expected_key,
+        'label': 'congruency',
+        'analysis': (None, None, 0),
+        'blocks': (
+            ('Test Flanker', 0, 'congr', 'NoRepetitionsTest',
+             (('blue_congr', CENTRE), ('red_congr', CENTRE), ('blue_incongr', CENTRE), ('red_incongr', CENTRE))),
+        ),
+    },
+}
+
+# parameters used for plans generated offline, the experiment scripts pass their own parameters
+DEFAULT_PARAMETERS = {
+    'no_probe_repetitions': 4,
+    'NoRepetitions': 4,
+    'NoRepetitionsTest': 8,
+    'FixDur': 3,
+    'blank_duration': 0.5,
+    'MaxRunLength': 3,
+    'BalanceTransitions': True,
+}
+
+
+def get_seed(seed=None):
+    """Gets integer seed stored in the plan.
+    :param seed: seed or 'None' for a new random seed
+    :return: integer seed
+    """
+    return int(numpy.random.SeedSequence(seed).entropy) if seed is None else int(seed)
+
+
+def create_plan(paradigm, parameters, seed=None, subject_id=None):
+    """Creates session plan with all blocks and trial orders.
+    :param paradigm: layout name in LAYOUTS, e.g. 'Dots'
+    :param parameters: experiment parameters with repetitions, durations and sequence constraints
+    :param seed: seed of the trial order or 'None' for a new random seed
+    :param subject_id: proband id the plan is generated for or 'None'
+    :return: plan dictionary
+    """
+    layout = LAYOUTS[paradigm]
+    seed = get_seed(seed)
+    rng = c_sequence.get_rng(seed)
+    cells = []
+    cell_index = {}
+    blocks = []
+    for dialog_text, step, tested_field_name, repetitions, block_cells in layout['blocks']:
+        indices = []
+        for stimulus_id, side in block_cells:
+            if (stimulus_id, side) not in cell_index:
+                color, congruent = layout['stimuli'][stimulus_id]
+                if layout['label'] == 'congruency':
+                    label = constant.STIMULI_CONGRUENT if congruent else constant.STIMULI_UNCONGRUENT
+                else:
+                    label = side
+                cell_index[(stimulus_id, side)] = len(cells)
+                cells.append({'stimulus': stimulus_id, 'side': side, 'label': label, 'congruent': congruent,
+                              'expected_key': layout['key_rule'](color, side)})
+            indices.append(cell_index[(stimulus_id, side)])
+        cell_counts = c_sequence.get_cell_counts(parameters[repetitions], len(indices), rng)
+        transition_labels = ([int(cells[index]['congruent']) for index in indices]
+                             if parameters['BalanceTransitions'] else None)
+        sequence = c_sequence.generate_sequences(cell_counts, 1, rng,
+                                                 [cells[index]['expected_key'] for index in indices],
+                                                 parameters['MaxRunLength'], transition_labels)[0]
+        blocks.append({'dialog': dialog_text, 'step': step, 'field': tested_field_name,
+                       'trials': [indices[index] for index in sequence]})
+    return {'format': constant.PLAN_FORMAT_VERSION, 'plan_id': '%s_%x' % (paradigm, seed), 'paradigm': paradigm,
+            'subject_id': subject_id, 'seed': seed,
+            'durations': {'FixDur': parameters['FixDur'], 'blank_duration': parameters['blank_duration']},
+            'cells': cells, 'blocks': blocks}
+
+
+def save_plan(plan, path):
+    """Writes plan file.
+    :param plan: plan dictionary
+    :param path: plan file path
+    """
+    c_file.write_atomic(path, json.dumps(plan, indent=1))
+
+
+def get_report_plan_path(report_path):
+    """Gets path of the plan copy for single report file path.
+    :param report_path: single report file path
+    :return: plan file path, which can be given as PlanFile to repeat the session
+    """
+    return os.path.splitext(report_path)[0] + constant.REPORT_PLAN_SUFFIX
+
+
+def load_plan(path, paradigm=None):
+    """Loads plan file.
+    :param path: plan file path
+    :param paradigm: expected paradigm name or 'None'
+    :return: plan dictionary
+    """
+    with open(path, 'r') as file:
+        plan = json.load(file)
+    if plan.get('format') != constant.PLAN_FORMAT_VERSION:
+        raise ValueError('unsupported plan format in %s' % path)
+    if paradigm is not None and plan['paradigm'] != paradigm:
+        raise ValueError('plan %s is for %s, not %s' % (plan['plan_id'], plan['paradigm'], paradigm))
+    return plan
+
+
+def get_session_plan(paradigm, parameters):
+    """Gets plan of the session: loads the plan file given in parameters['PlanFile'] or creates a new plan.
+    The plan durations override the experiment parameters.
+    :param paradigm: layout name in LAYOUTS
+    :param parameters: experiment parameters
+    :return: plan dictionary
+    """
+    if parameters['PlanFile']:
+        plan = load_plan(parameters['PlanFile'], paradigm)
+    else:
+        plan = create_plan(paradigm, parameters, parameters['Seed'])
+    parameters.update(plan['durations'])
+    return plan
+
+
+def get_block_trials(plan, stimuli, positions, cache=None):
+    """Resolves trial descriptors of all blocks, one c_result.Trial per plan cell.
+    :param plan: plan dictionary
+    :param stimuli: dictionary stimulus id -> c_result.Stimulus
+    :param positions: dictionary side -> elements positions
+    :param cache: c_stimcache.StimulusCache or 'None'. If given, the stimulus elements are names of cached elements
+    and each trial gets its composite screen
+    :return: list of c_result.Trial lists, one per block
+    """
+    trials = []
+    for cell in plan['cells']:
+        stimulus = stimuli[cell['stimulus']]
+        elements_pos = positions[cell['side']]
+        if cache is not None:
+            stimulus = c_result.Stimulus(stimulus.stimulus_id, cache.get_screen(stimulus.elements, elements_pos),
+                                         stimulus.color, stimulus.congruent)
+        trials.append(c_result.Trial(stimulus, elements_pos, cell['side'], cell['label'], cell['expected_key']))
+    return [[trials[index] for index in block['trials']] for block in plan['blocks']]
+
+
+def create_cohort_plans(paradigm, subject_ids, output_dir, parameters=None, seed=None):
+    """Generates plan files for a cohort. The subject seeds are derived from one cohort seed.
+    :param paradigm: layout name in LAYOUTS
+    :param subject_ids: list of proband ids
+    :param output_dir: directory of the plan files
+    :param parameters: experiment parameters or 'None' for DEFAULT_PARAMETERS
+    :param seed: cohort seed or 'None' for a new random seed
+    :return: list of written plan file paths
+    """
+    parameters = DEFAULT_PARAMETERS if parameters is None else parameters
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    subject_seeds = numpy.random.SeedSequence(get_seed(seed)).generate_state(len(subject_ids), numpy.uint64)
+    paths = []
+    for subject_id, subject_seed in zip(subject_ids, subject_seeds):
+        plan = create_plan(paradigm, parameters, int(subject_seed), subject_id)
+        path = os.path.join(output_dir, '%s_%s%s' % (paradigm, subject_id, constant.PLAN_FILE_SUFFIX))
+        save_plan(plan, path)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate session plan files for a cohort.')
+    parser.add_argument('paradigm', choices=sorted(LAYOUTS))
+    parser.add_argument('subject_ids', nargs='+', help='proband ids')
+    parser.add_argument('--seed', type=int, default=None, help='cohort seed (default: random, stored per plan)')
+    parser.add_argument('--output-dir', default='plans', help='directory of the plan files')
+    args = parser.parse_args(argv)
+    for path in create_cohort_plans(args.paradigm, args.subject_ids, args.output_dir, seed=args.seed):
+        print('written', path)
+
+
+if __name__ == '__main__':
+    main()
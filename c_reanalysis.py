@@ -0,0 +1,213 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Headless re-analysis of existing result directories. Parses all single report files (or their structured
+trial stores) and rebuilds the general analysis report rows with the same Result fields as the live analysis.
+With --merge, the general analysis reports are rebuilt from the row fragments written by the sessions instead.
+
+Usage: python c_reanalysis.py [data_dir ...] [--too-fast-time MS] [--workers N] [--output-suffix SUFFIX]
+       python c_reanalysis.py [data_dir ...] --merge
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import functools
+import glob
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import c_file
+import c_plan
+import c_result
+import c_store
+import constant
+
+DEFAULT_DATA_PATHS = ('dots_result_files', 'flanker_result_files')
+DEFAULT_PREFIXES = ('Dots', 'Flanker')
+
+
+def read_report_steps(path):
+    """Parses single report file into step tables.
+    :param path: single report file path
+    :return: dictionary step -> (answers, correctness, reaction times in seconds), correctness is -1 for
+    trials without answer (timeout)
+    """
+    steps = {}
+    step = 0
+    in_table = False
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.rstrip('\n')
+            fields = line.split('\t')
+            if line.strip().startswith('Step '):
+                step = int(line.split()[1])
+            elif line.startswith('trial\t'):
+                in_table = True
+                steps[step] = ([], [], [])
+            elif not line.strip():
+                in_table = False
+            elif in_table and len(fields) >= 6:
+                answers, correctness, react_times = steps[step]
+                answers.append(fields[3])
+                correctness.append(-1 if fields[4] == constant.STIMULI_NO_ANSWER else int(fields[4]))
+                react_times.append(float(fields[5]) / 1000)
+    return dict((step, (numpy.array(answers), numpy.array(correctness, dtype='i1'), numpy.array(react_times)))
+                for step, (answers, correctness, react_times) in steps.items())
+
+
+def read_store_steps(path):
+    """Reads structured trial store into step tables. The key presses are taken before the too fast rule of the
+    session was applied; stores written without the raw fields only have the answers after that rule.
+    :param path: trial store file path
+    :return: dictionary step -> (answers, correctness, reaction times in seconds)
+    """
+    records = c_store.load_session(path)
+    fields = ('raw_answer', 'raw_correct', 'raw_rt') if 'raw_rt' in records.dtype.names else ('answer', 'correct', 'rt')
+    return dict((int(step), tuple(records[field][records['step'] == step] for field in fields))
+                for step in numpy.unique(records['step']))
+
+
+def build_step_result(answers, correctness, react_times, too_fast_time):
+    """Creates Result class from step tables using vectorized statistics.
+    :param answers: answers per trial ('L', 'R' or '-')
+    :param correctness: correctness per trial (1, 0 or -1 for no answer)
+    :param react_times: reaction times in seconds
+    :param too_fast_time: threshold for too fast key pressing in ms, applied to answered trials. Too fast key
+    presses of single report files were already stored without answer by the session
+    :return: created and populated Result class
+    """
+    answered = (correctness >= 0) & (answers != constant.STIMULI_NO_ANSWER)
+    valid = answered & (react_times * 1000 >= too_fast_time)
+    correct = valid & (correctness == 1)
+    correct_count = int(correct.sum())
+    incorrect_count = int((valid & (correctness == 0)).sum())
+    mean = 0.0
+    median = 0.0
+    if correct_count:
+        mean = float(react_times[correct].mean())
+        median = float(numpy.median(react_times[correct]))
+    number_repetitions = max(len(correctness), 1)
+    return c_result.Result(correct_count, correct_count / number_repetitions * 100, mean * 1000, median * 1000,
+                           incorrect_count, len(correctness) - correct_count - incorrect_count)
+
+
+def analyse_session_file(path, too_fast_time, analysis_steps):
+    """Rebuilds general analysis report row of a single session.
+    :param path: single report file path
+    :param too_fast_time: threshold for too fast key pressing in ms
+    :param analysis_steps: steps of the congruent, incongruent and mixed results, see c_plan.LAYOUTS
+    :return: general analysis report row or 'None', if the session is incomplete (e.g. terminated before its last
+    analysed step)
+    """
+    store_path = c_store.get_store_path(path)
+    steps = read_store_steps(store_path) if os.path.isfile(store_path) else read_report_steps(path)
+    if any(step is not None and step not in steps for step in analysis_steps):
+        return None
+    proband_id = os.path.basename(path).split('_')[1]
+    congruent, incongruent, mixed = [None if step is None else build_step_result(*steps[step], too_fast_time)
+                                     for step in analysis_steps]
+    row = io.StringIO()
+    if congruent is not None:
+        c_file.write_congruent_analysis(row, congruent, proband_id, '')
+    if incongruent is not None:
+        c_file.write_result_analysis(row, incongruent, '')
+    if congruent is None and incongruent is None:
+        row.write("\n" + proband_id)
+    c_file.write_result_analysis(row, mixed, '')
+    return row.getvalue()
+
+
+def get_session_files(data_path, prefix):
+    """Gets single report files of a data directory.
+    :param data_path: data directory
+    :param prefix: report file prefix, e.g. 'Dots'
+    :return: sorted list of single report file paths
+    """
+    return sorted(glob.glob(os.path.join(data_path, prefix + '_*.txt')))
+
+
+def reanalyse(data_path, prefix, too_fast_time, workers, output_suffix):
+    """Rebuilds general analysis report of a data directory using a process pool.
+    :param data_path: data directory
+    :param prefix: report file prefix and layout name in c_plan.LAYOUTS, e.g. 'Dots'
+    :param too_fast_time: threshold for too fast key pressing in ms
+    :param workers: number of worker processes or 'None' for the number of processors
+    :param output_suffix: suffix added to the general analysis report file name
+    :return: path of the written report or 'None', if there are no session files
+    """
+    paths = get_session_files(data_path, prefix)
+    if not paths:
+        return None
+    analyse = functools.partial(analyse_session_file, too_fast_time=too_fast_time,
+                                analysis_steps=c_plan.LAYOUTS[prefix]['analysis'])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(analyse, paths, chunksize=max(1, len(paths) // 64)))
+    for path, row in zip(paths, rows):
+        if row is None:
+            print('incomplete session skipped:', path)
+    report = io.StringIO()
+    c_file.write_analysis_header_mixed(report, "")
+    report.write(''.join(row for row in rows if row))
+    report_name, report_ext = os.path.splitext("_" + prefix + constant.REPORT_FILE_NAME)
+    output_path = os.path.join(data_path, report_name + output_suffix + report_ext)
+    c_file.write_atomic(output_path, report.getvalue())
+    return output_path
+
+
+def merge(data_path, prefix):
+    """Merges the session fragments of a data directory into its general analysis report.
+    :param data_path: data directory
+    :param prefix: report file prefix, e.g. 'Dots'
+    :return: path of the merged report, 'None', if there are no fragments of the prefix, or 'False', if the report
+    is locked
+    """
+    report_fie_name = "_" + prefix + constant.REPORT_FILE_NAME
+    if not os.path.isdir(c_file.get_fragment_dir(data_path, report_fie_name)):
+        return None
+    if not c_file.merge_analysis_fragments(data_path, report_fie_name):
+        return False
+    return c_file.get_file(data_path, report_fie_name)
+
+
+def main(argv=None):
+    """Runs re-analysis or merge of the data directories given on the command line.
+    :param argv: command line arguments or 'None' for sys.argv
+    :return: exit status, 1 if a merge found no fragments or a report was locked
+    """
+    parser = argparse.ArgumentParser(description='Rebuild general analysis reports from existing session files.')
+    parser.add_argument('data_paths', nargs='*', help='result directories (default: %s, relative to the scripts)'
+                        % ', '.join(DEFAULT_DATA_PATHS))
+    parser.add_argument('--too-fast-time', type=float, default=200, help='threshold for too fast key pressing in ms')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--output-suffix', default='_reanalysed', help='suffix of the rebuilt report file names')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the session fragments into the general analysis reports')
+    args = parser.parse_args(argv)
+    # command line paths are relative to the current directory, c_file resolves relative paths to the scripts
+    data_paths = [os.path.abspath(data_path) for data_path in args.data_paths] or \
+        [c_file.get_file(data_path, '') for data_path in DEFAULT_DATA_PATHS]
+    status = 0
+    for data_path in data_paths:
+        merged = False
+        for prefix in DEFAULT_PREFIXES:
+            if args.merge:
+                output_path = merge(data_path, prefix)
+                merged = merged or output_path is not None
+                if output_path is False:
+                    status = 1
+            else:
+                output_path = reanalyse(data_path, prefix, args.too_fast_time, args.workers, args.output_suffix)
+            if output_path:
+                print('written', output_path)
+        if args.merge and not merged:
+            print('no session fragments found, nothing merged:', data_path)
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
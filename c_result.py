@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 """Experiment related classes and functions"""
 
-import numpy
+import bisect
+
+import constant
 
 
 class Result:
@@ -16,13 +18,103 @@ class Result:
         self.x_err = x_err
 
 
+class StreamingMedian:
+    """Median of a value stream in constant memory. Up to 'exact_limit' values the median is exact, beyond that
+    it is estimated by the P-square algorithm (Jain and Chlamtac, 1985) without storing the values """
+    def __init__(self, exact_limit=constant.STREAMING_MEDIAN_EXACT_LIMIT):
+        self.exact_limit = max(exact_limit, 5)
+        self._values = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+    def add(self, value):
+        """Adds value to the stream.
+        :param value: value to add
+        """
+        if self._heights is None:
+            bisect.insort(self._values, value)
+            if len(self._values) > self.exact_limit:
+                self._init_markers()
+            return
+        heights = self._heights
+        positions = self._positions
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = bisect.bisect_right(heights, value, 0, 4) - 1
+        for i in range(cell + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        for i in range(1, 4):
+            shift = self._desired[i] - positions[i]
+            if (shift >= 1 and positions[i + 1] - positions[i] > 1) or \
+                    (shift <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if shift > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                heights[i] = height
+                positions[i] += step
+
+    def _parabolic(self, i, step):
+        q = self._heights
+        n = self._positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                                                      (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def _init_markers(self):
+        last = len(self._values) - 1
+        self._desired = [last * increment for increment in self._increments]
+        self._positions = [int(round(desired)) for desired in self._desired]
+        self._heights = [self._values[position] for position in self._positions]
+        self._values = []
+
+    @property
+    def median(self):
+        """Current median or 0.0, if no value was added"""
+        if self._heights is not None:
+            return self._heights[2]
+        count = len(self._values)
+        if not count:
+            return 0.0
+        middle = count // 2
+        if count % 2:
+            return self._values[middle]
+        return (self._values[middle - 1] + self._values[middle]) / 2
+
+
+class RunningStats:
+    """Incremental statistics of a value stream: count, mean and streaming median, as reported in Result """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._median = StreamingMedian()
+
+    def add(self, value):
+        """Adds value in O(1).
+        :param value: value to add
+        """
+        self.count += 1
+        self.mean += (value - self.mean) / self.count
+        self._median.add(value)
+
+    @property
+    def median(self):
+        """Median or 0.0, if no value was added"""
+        return self._median.median
+
+
 class CumulativeResult:
-    """Class containing cumulative results """
+    """Class containing cumulative results. Times are kept as float seconds without rounding """
     def __init__(self):
-        self.cumulative_time = 0.0
-        self.correct_count = 0
-        self.incorrect_count = 0
-        self.timeout_too_fast_count = 0
+        self.reset()
 
     def reset(self):
         """Reset values """
@@ -30,97 +122,62 @@ class CumulativeResult:
         self.correct_count = 0
         self.incorrect_count = 0
         self.timeout_too_fast_count = 0
+        self.dropped_frame_count = 0
+        self.time_stats = RunningStats()
 
+    def add_correct_time(self, diff_time):
+        """Adds reaction time of a correct answer.
+        :param diff_time: reaction time in seconds
+        """
+        self.cumulative_time += diff_time
+        self.time_stats.add(diff_time)
 
-def build_result(cumulative_result, number_repetitions, results):
+
+def build_result(cumulative_result, number_repetitions):
     """Creates Result class from single step execution.
     :param cumulative_result: CumulativeResult class instance
     :param number_repetitions: number of repetitions
-    :param results: list filled with time values
     :return: created and populated Result class
     """
-    np_array = numpy.array(results)
+    time_stats = cumulative_result.time_stats
+    return Result(cumulative_result.correct_count, cumulative_result.correct_count / number_repetitions * 100,
+                  time_stats.mean * 1000, time_stats.median * 1000, cumulative_result.incorrect_count,
+                  cumulative_result.timeout_too_fast_count)
 
-    mean = np_array.mean()
-    if numpy.isnan(mean):
-        mean = 0.0
 
-    median = numpy.median(np_array)
-    if numpy.isnan(median):
-        median = 0.0
+class Stimulus:
+    """Stimulus description: drawable elements, color and congruency """
+    __slots__ = ('stimulus_id', 'elements', 'color', 'congruent')
 
-    x = Result(cumulative_result.correct_count, cumulative_result.correct_count / number_repetitions * 100,
-               mean*1000, median*1000, cumulative_result.incorrect_count,
-               cumulative_result.timeout_too_fast_count)
-    results.clear()
-    return x
+    def __init__(self, stimulus_id, elements, color, congruent):
+        self.stimulus_id = stimulus_id
+        self.elements = elements
+        self.color = color
+        self.congruent = congruent
 
 
-def create_colored_stimuli(number_repetitions, colored_elements, elements_pos_right, elements_pos_left):
-    """Creates colored (ocnly red or only blue) stimuli.
-    :param number_repetitions: number of repetitions
-    :param colored_elements: colored elements
-    :param elements_pos_right: colored elements in right positions
-    :param elements_pos_left: colored elements in left positions
-    :return: created colored stimuli
+def get_scoring_table(expected_key):
+    """Precomputes scoring of the response keys.
+    :param expected_key: key code expected as correct answer
+    :return: dictionary response key code -> (pressed key 'L' or 'R', correctness '1' or '0')
     """
-    normed_probe = round(number_repetitions / 2)
-    stimuli_probe_colored = [[0 for x in range(2)] for y in range(number_repetitions)]
-    for i in range(normed_probe):
-        stimuli_probe_colored[i][0] = colored_elements
-        stimuli_probe_colored[i][1] = elements_pos_right
-        stimuli_probe_colored[i + normed_probe][0] = colored_elements
-        stimuli_probe_colored[i + normed_probe][1] = elements_pos_left
-    return stimuli_probe_colored
-
-
-def create_mixed_stimuli(number_repetitions, elements_congruent, elements_pos_right, elements_pos_left,
-                         elements_uncongruent):
-    """Creates mixed stimuli.
-    :param number_repetitions: number of repetitions
-    :param elements_congruent: congruent elements
-    :param elements_pos_right: colored elements in right positions
-    :param elements_pos_left: colored elements in left positions
-    :param elements_uncongruent: non congruent elements
-    :return: created mixed stimuli
-    """
-    normed = round(number_repetitions / 4)
-    stimuli = [[0 for x in range(2)] for y in range(number_repetitions)]
-    for i in range(normed):
-        stimuli[i][0] = elements_congruent
-        stimuli[i][1] = elements_pos_right
-        stimuli[i + normed][0] = elements_congruent
-        stimuli[i + normed][1] = elements_pos_left
-        stimuli[i + round(number_repetitions / 2)][0] = elements_uncongruent
-        stimuli[i + round(number_repetitions / 2)][1] = elements_pos_left
-        stimuli[i + 3 * normed][0] = elements_uncongruent
-        stimuli[i + 3 * normed][1] = elements_pos_right
-    return stimuli
-
-
-def create_mixed_stimuli_centred(number_repetitions, elements_congruent_blue, elements_congruent_red,
-                          elements_uncongruent_blue, elements_uncongruent_red, elements_pos):
-    """Creates mixed stimuli for centred experiments.
-    :param number_repetitions: number of repetitions
-    :param elements_congruent_blue: congruent elements blue color
-    :param elements_congruent_red: congruent elements red color
-    :param elements_uncongruent_blue: non-congruent elements blue color
-    :param elements_uncongruent_red:  non-congruent elements red color
-    :param elements_pos:  elements positions
-    :return: created mixed stimuli
-    """
-    normed = round(number_repetitions / 4)
-    stimuli = [[0 for x in range(2)] for y in range(number_repetitions)]
-    for i in range(normed):
-        stimuli[i][0] = elements_congruent_blue
-        stimuli[i][1] = elements_pos
-        stimuli[i + normed][0] = elements_congruent_red
-        stimuli[i + normed][1] = elements_pos
-        stimuli[i + round(number_repetitions / 2)][0] = elements_uncongruent_blue
-        stimuli[i + round(number_repetitions / 2)][1] = elements_pos
-        stimuli[i + 3 * normed][0] = elements_uncongruent_red
-        stimuli[i + 3 * normed][1] = elements_pos
-    return stimuli
-
-
-
+    table = {}
+    for key_code, pressed_key in ((constant.LEFT_KEYCODE, constant.KEY_PRESSED_LEFT),
+                                  (constant.RIGHT_KEYCODE, constant.KEY_PRESSED_RIGHT)):
+        table[key_code] = (pressed_key,
+                           constant.ANSWER_CORRECT if key_code == expected_key else constant.ANSWER_INCORRECT)
+    return table
+
+
+class Trial:
+    """Single trial: stimulus, element positions, stimulus side, value of the tested report field, the key
+    expected as correct answer and the scoring table of the response keys """
+    __slots__ = ('stimulus', 'positions', 'side', 'label', 'expected_key', 'scores')
+
+    def __init__(self, stimulus, positions, side, label, expected_key):
+        self.stimulus = stimulus
+        self.positions = positions
+        self.side = side
+        self.label = label
+        self.expected_key = expected_key
+        self.scores = get_scoring_table(expected_key)
@@ -0,0 +1,181 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Counterbalanced trial sequence generation. Sequences are drawn in vectorized NumPy batches from exact cell
+counts, balanced transitions are constructed from random run lengths and run length constraints are filtered"""
+
+from __future__ import absolute_import, division, print_function
+
+import numpy
+
+import constant
+
+
+def get_rng(seed=None):
+    """Gets random generator for reproducible sequences.
+    :param seed: seed or 'None' for a random seed
+    :return: numpy.random.Generator
+    """
+    return numpy.random.default_rng(seed)
+
+
+def get_cell_counts(number_repetitions, number_cells, rng=None):
+    """Distributes trials exactly over cells. The remainder of the division is assigned to randomly chosen cells,
+    so no trial is dropped for any number of repetitions.
+    :param number_repetitions: number of trials
+    :param number_cells: number of cells (e.g. stimulus and position combinations)
+    :param rng: numpy.random.Generator or 'None' to assign the remainder to the first cells
+    :return: numpy array of trial counts per cell
+    """
+    counts = numpy.full(number_cells, number_repetitions // number_cells, dtype=numpy.int64)
+    remainder = number_repetitions % number_cells
+    if remainder:
+        cells = numpy.arange(remainder) if rng is None else rng.choice(number_cells, remainder, replace=False)
+        counts[cells] += 1
+    return counts
+
+
+def get_run_violations(labels, max_run_length):
+    """Checks sequences for runs of equal labels longer than allowed.
+    :param labels: two dimensional array (sequences x trials) of labels
+    :param max_run_length: maximum number of consecutive trials with equal label
+    :return: boolean array, 'True' for sequences violating the constraint
+    """
+    if max_run_length is None or max_run_length >= labels.shape[1]:
+        return numpy.zeros(labels.shape[0], dtype=bool)
+    same = (labels[:, 1:] == labels[:, :-1]).astype(numpy.int32)
+    cumulative = numpy.concatenate([numpy.zeros((labels.shape[0], 1), dtype=numpy.int32),
+                                    numpy.cumsum(same, axis=1)], axis=1)
+    # a run longer than max_run_length contains max_run_length equal neighbour pairs in a row
+    window = cumulative[:, max_run_length:] - cumulative[:, :-max_run_length]
+    return (window == max_run_length).any(axis=1)
+
+
+def get_transition_imbalance(labels):
+    """Gets imbalance of transitions between binary labels (e.g. congruent/incongruent).
+    :param labels: two dimensional array (sequences x trials) of 0/1 labels
+    :return: array of max - min count of the four transition types per sequence
+    """
+    transitions = 2 * labels[:, :-1] + labels[:, 1:]
+    counts = (transitions[:, :, numpy.newaxis] == numpy.arange(4)).sum(axis=1)
+    return counts.max(axis=1) - counts.min(axis=1)
+
+
+def get_run_structures(count_0, count_1, tolerance):
+    """Gets run structures of binary sequences with balanced transitions. A sequence starting with label 'start'
+    alternates between runs of both labels, the number of runs defines the counts of the transition types.
+    :param count_0: number of trials with label 0
+    :param count_1: number of trials with label 1
+    :param tolerance: maximum difference between the counts of the transition types
+    :return: list of (start label, runs of label 0, runs of label 1) with the smallest possible imbalance,
+    but at least all structures within tolerance
+    """
+    structures = []
+    for runs_0 in range(1, count_0 + 1):
+        for runs_1 in (runs_0 - 1, runs_0, runs_0 + 1):
+            if runs_1 < 1 or runs_1 > count_1:
+                continue
+            for start in (0, 1):
+                first, second = (runs_0, runs_1) if start == 0 else (runs_1, runs_0)
+                if first < second:
+                    continue
+                switches = runs_0 + runs_1 - 1
+                forward = (switches + 1) // 2
+                transitions = (count_0 - runs_0, forward if start == 0 else switches - forward,
+                               switches - forward if start == 0 else forward, count_1 - runs_1)
+                structures.append((max(transitions) - min(transitions), start, runs_0, runs_1))
+    limit = max(tolerance, min(structure[0] for structure in structures))
+    return [structure[1:] for structure in structures if structure[0] <= limit]
+
+
+def get_compositions(total, parts, number, rng):
+    """Splits a total into random positive parts.
+    :param total: total to split
+    :param parts: number of parts
+    :param number: number of compositions
+    :param rng: numpy.random.Generator
+    :return: two dimensional array (compositions x parts)
+    """
+    cuts = numpy.sort(rng.random((number, total - 1)).argsort(axis=1)[:, :parts - 1] + 1, axis=1)
+    bounds = numpy.concatenate([numpy.zeros((number, 1), dtype=cuts.dtype), cuts,
+                                numpy.full((number, 1), total, dtype=cuts.dtype)], axis=1)
+    return numpy.diff(bounds, axis=1)
+
+
+def get_balanced_labels(count_0, count_1, number, rng, tolerance):
+    """Draws binary label sequences with balanced transitions.
+    :param count_0: number of trials with label 0
+    :param count_1: number of trials with label 1
+    :param number: number of sequences
+    :param rng: numpy.random.Generator
+    :param tolerance: maximum difference between the counts of the transition types
+    :return: two dimensional array (sequences x trials) of 0/1 labels
+    """
+    structures = get_run_structures(count_0, count_1, tolerance)
+    choices = rng.integers(len(structures), size=number)
+    labels = numpy.empty((number, count_0 + count_1), dtype=numpy.int8)
+    for index, (start, runs_0, runs_1) in enumerate(structures):
+        rows = numpy.flatnonzero(choices == index)
+        if not len(rows):
+            continue
+        runs = (get_compositions(count_0, runs_0, len(rows), rng), get_compositions(count_1, runs_1, len(rows), rng))
+        lengths = numpy.zeros((len(rows), runs_0 + runs_1), dtype=numpy.int64)
+        lengths[:, 0::2] = runs[start]
+        lengths[:, 1::2] = runs[1 - start]
+        marks = numpy.zeros((len(rows), count_0 + count_1), dtype=numpy.int64)
+        numpy.put_along_axis(marks, numpy.cumsum(lengths, axis=1)[:, :-1], 1, axis=1)
+        labels[rows] = (numpy.cumsum(marks, axis=1) + start) % 2
+    return labels
+
+
+def generate_sequences(cell_counts, number_sequences, rng, run_labels=None, max_run_length=None,
+                       transition_labels=None, transition_tolerance=constant.TRANSITION_TOLERANCE,
+                       batch_size=constant.SEQUENCE_BATCH_SIZE, max_batches=constant.SEQUENCE_MAX_BATCHES):
+    """Generates constrained random sequences of cell indices. With transition labels, the label sequences are
+    built with balanced transitions and the cells are permuted within each label; the run length constraint is
+    applied by rejection.
+    :param cell_counts: exact number of trials per cell
+    :param number_sequences: number of sequences to generate
+    :param rng: numpy.random.Generator
+    :param run_labels: label per cell for the run length constraint (e.g. expected key) or 'None'
+    :param max_run_length: maximum number of consecutive trials with equal run label or 'None'
+    :param transition_labels: 0/1 label per cell for balanced transitions (e.g. congruency) or 'None'
+    :param transition_tolerance: maximum difference between the counts of the transition types
+    :param batch_size: number of candidate sequences drawn at once
+    :param max_batches: maximum number of batches in a row without any valid sequence, before the constraints are
+    considered unsatisfiable
+    :return: two dimensional array (sequences x trials) of cell indices
+    """
+    cell_counts = numpy.asarray(cell_counts, dtype=numpy.int64)
+    base = numpy.repeat(numpy.arange(len(cell_counts)), cell_counts)
+    # constraints on a single label class can't be satisfied and are not meaningful
+    if run_labels is not None and len(set(numpy.asarray(run_labels)[base])) < 2:
+        run_labels = None
+    if transition_labels is not None:
+        transition_labels = numpy.asarray(transition_labels, dtype=numpy.int8)
+        if len(set(transition_labels[base])) < 2:
+            transition_labels = None
+    accepted = []
+    accepted_count = 0
+    empty_batches = 0
+    while empty_batches < max_batches:
+        if transition_labels is None:
+            candidates = rng.permuted(numpy.tile(base, (batch_size, 1)), axis=1)
+        else:
+            base_labels = transition_labels[base]
+            labels = get_balanced_labels(int((base_labels == 0).sum()), int((base_labels == 1).sum()), batch_size,
+                                         rng, transition_tolerance)
+            candidates = numpy.empty_like(labels, dtype=numpy.int64)
+            for label in (0, 1):
+                cells = base[base_labels == label]
+                positions = numpy.argsort(labels != label, axis=1, kind='stable')[:, :len(cells)]
+                numpy.put_along_axis(candidates, positions, rng.permuted(numpy.tile(cells, (batch_size, 1)), axis=1),
+                                     axis=1)
+        valid = numpy.ones(batch_size, dtype=bool)
+        if run_labels is not None:
+            valid &= ~get_run_violations(numpy.asarray(run_labels)[candidates], max_run_length)
+        accepted.append(candidates[valid])
+        accepted_count += int(valid.sum())
+        empty_batches = 0 if valid.any() else empty_batches + 1
+        if accepted_count >= number_sequences:
+            return numpy.concatenate(accepted)[:number_sequences]
+    raise ValueError('trial sequence constraints cannot be satisfied for cell counts %s' % cell_counts.tolist())
@@ -0,0 +1,290 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Simulation backend. A simulated participant answers the trials of a session plan on a virtual clock: the window
+only advances the clock to the next frame, the device samples responses from an ex-Gaussian reaction time
+distribution (or replays given responses). The real trial engine (c_experiment_core.ExperimentSession), the
+scoring and the c_file reports run unchanged, much faster than real time.
+
+Usage: python c_simulation.py {Dots,Flanker} [--sessions N] [--seed SEED] [--output-dir DIR] [--rt-mu S] ...
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import math
+import os
+import time
+
+import numpy
+
+import c_experiment_core
+import c_file
+import c_plan
+import c_result
+import constant
+
+
+class SimulatedClock:
+    """Virtual monotonic clock, replaces core.monotonicClock."""
+    def __init__(self):
+        self.now = 0.0
+
+    def getTime(self):
+        """
+        :return: virtual time in seconds
+        """
+        return self.now
+
+    def advance(self, duration):
+        """Advances the virtual time.
+        :param duration: duration in seconds, negative durations are ignored
+        """
+        if duration > 0:
+            self.now += duration
+
+
+class SimulatedWindow:
+    """Window without display. A flip is synchronised to the next frame of the virtual clock, consecutive flips
+    are at least one frame apart."""
+    def __init__(self, clock, frame_period=constant.SIMULATION_FRAME_PERIOD):
+        self.clock = clock
+        self.monitorFramePeriod = frame_period
+        self.flip_count = 0
+        self.last_frame = None
+
+    def flip(self):
+        """
+        :return: flip time stamp on the virtual clock
+        """
+        # the tolerance keeps a flip requested exactly at a frame boundary on that frame
+        frame = math.ceil((self.clock.now - 1e-9) / self.monitorFramePeriod)
+        if self.last_frame is not None:
+            frame = max(frame, self.last_frame + 1)
+        self.last_frame = frame
+        self.clock.now = max(self.clock.now, frame * self.monitorFramePeriod)
+        self.flip_count += 1
+        return self.clock.now
+
+    def clearBuffer(self):
+        pass
+
+
+class SimulatedEvent:
+    """Keyboard of the simulated participant, every dialog is confirmed at once."""
+    def __init__(self, wait_key='space'):
+        self.wait_key = wait_key
+
+    def getKeys(self, keyList=None):
+        return [self.wait_key]
+
+    def clearEvents(self):
+        pass
+
+
+class NullStimulus:
+    """Stimulus without display."""
+    def draw(self):
+        pass
+
+
+class NullCompositor:
+    """Compositor returning stimuli without display."""
+    def __init__(self):
+        self.screen = NullStimulus()
+
+    def get(self, key, elements, text_element=None, text=None):
+        return self.screen
+
+
+class NullStimulusCache:
+    """Stimulus cache of the simulated window, nothing to load or draw."""
+    def __init__(self):
+        self.compositor = NullCompositor()
+
+    def warm_up(self):
+        pass
+
+
+def get_expected_keys(plan):
+    """Gets keys expected as correct answers in presentation order of all plan blocks.
+    :param plan: plan dictionary
+    :return: list of LEFT_KEYCODE or RIGHT_KEYCODE
+    """
+    return [plan['cells'][index]['expected_key'] for block in plan['blocks'] for index in block['trials']]
+
+
+def sample_responses(expected_keys, rng, rt_mu=constant.SIMULATION_RT_MU, rt_sigma=constant.SIMULATION_RT_SIGMA,
+                     rt_tau=constant.SIMULATION_RT_TAU, accuracy=constant.SIMULATION_ACCURACY,
+                     miss_rate=constant.SIMULATION_MISS_RATE):
+    """Samples responses of a simulated participant.
+    :param expected_keys: keys expected as correct answers, one per trial
+    :param rng: numpy.random.Generator
+    :param rt_mu: mean of the normal part of the reaction time in seconds
+    :param rt_sigma: standard deviation of the normal part of the reaction time in seconds
+    :param rt_tau: mean of the exponential part of the reaction time in seconds
+    :param accuracy: probability of the correct key
+    :param miss_rate: probability of no response
+    :return: list of (key, reaction time in seconds), reaction time 'None' for missed trials
+    """
+    number = len(expected_keys)
+    reaction_times = numpy.maximum(rng.normal(rt_mu, rt_sigma, number) + rng.exponential(rt_tau, number), 0.0)
+    correct = rng.random(number) < accuracy
+    missed = rng.random(number) < miss_rate
+    responses = []
+    for expected_key, reaction_time, is_correct, is_missed in zip(expected_keys, reaction_times, correct, missed):
+        if is_missed:
+            responses.append((expected_key, None))
+            continue
+        if is_correct:
+            key = expected_key
+        else:
+            key = constant.LEFT_KEYCODE if expected_key == constant.RIGHT_KEYCODE else constant.RIGHT_KEYCODE
+        responses.append((key, float(reaction_time)))
+    return responses
+
+
+class SimulatedDevice:
+    """Device reader of the simulated participant, replays one response per armed trial. Waiting for a response
+    advances the virtual clock to the key press or to the timeout."""
+    def __init__(self, clock, responses):
+        self.clock = clock
+        self.responses = iter(responses)
+        self.key = None
+        self.reaction_time = None
+        self.press_time = None
+        self.armed = False
+
+    def arm(self):
+        """Takes the response of the next trial, timed from the stimulus onset."""
+        self.armed = True
+        self.key, self.reaction_time = next(self.responses)
+        self.press_time = None
+
+    def disarm(self):
+        self.armed = False
+
+    def clear(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get(self, timeout):
+        """Waits for the key press of the current trial.
+        :param timeout: wait time in seconds
+        :return: two dimensional array with one element, containing event key and key time stamp,
+        'None' on timeout
+        """
+        if self.reaction_time is not None:
+            # the first wait starts at the stimulus onset
+            self.press_time = self.clock.getTime() + self.reaction_time
+            self.reaction_time = None
+        if not self.armed or self.press_time is None or self.press_time > self.clock.getTime() + timeout:
+            # like a real clock, the wait ends just after the deadline, so the timeout is detected by the caller
+            self.clock.advance(max(timeout, 0.0) + 1e-6)
+            return None
+        # the event is time stamped at the key press, even if it is polled later
+        key_time = self.press_time
+        self.clock.now = max(self.clock.now, key_time)
+        self.press_time = None
+        return [(self.key, key_time)]
+
+
+def get_parameters(paradigm, output_dir):
+    """Gets experiment parameters of simulated sessions.
+    :param paradigm: layout name in c_plan.LAYOUTS
+    :param output_dir: directory of the report files
+    :return: parameters dictionary
+    """
+    parameters = dict(c_plan.DEFAULT_PARAMETERS)
+    parameters.update({'DataPath': os.path.abspath(output_dir), 'FilePrefix': paradigm,
+                       'HeaderStaff': 'simulated participant', 'WaitKey': 'space', 'WaitKeyText': 'Leertaste',
+                       'DataFlag': False, 'MonitorFlag': False, 'too_fast_time': 200, 'SubjectID': '0'})
+    return parameters
+
+
+def get_stimuli(paradigm):
+    """Gets stimuli without display of a paradigm.
+    :param paradigm: layout name in c_plan.LAYOUTS
+    :return: dictionary stimulus id -> c_result.Stimulus
+    """
+    return dict((stimulus_id, c_result.Stimulus(stimulus_id, (), color, congruent))
+                for stimulus_id, (color, congruent) in c_plan.LAYOUTS[paradigm]['stimuli'].items())
+
+
+def simulate_session(paradigm, parameters, subject_id, seed, report_worker, **response_options):
+    """Runs one session of a simulated participant.
+    :param paradigm: layout name in c_plan.LAYOUTS
+    :param parameters: experiment parameters, see get_parameters
+    :param subject_id: proband id
+    :param seed: seed of the plan and of the responses
+    :param report_worker: c_file.ReportWorker
+    :param response_options: reaction time distribution, accuracy and miss rate, see sample_responses
+    :return: dictionary step -> c_result.Result and the virtual session time in seconds
+    """
+    plan_seed, response_seed = numpy.random.SeedSequence(seed).generate_state(2, numpy.uint64)
+    plan = c_plan.create_plan(paradigm, parameters, int(plan_seed), subject_id)
+    clock = SimulatedClock()
+    device_reader = SimulatedDevice(clock, sample_responses(get_expected_keys(plan),
+                                                            numpy.random.default_rng(int(response_seed)),
+                                                            **response_options))
+    positions = dict((cell['side'], ((0, 0),) * 4) for cell in plan['cells'])
+    block_trials = c_plan.get_block_trials(plan, get_stimuli(paradigm), positions)
+    session = c_experiment_core.ExperimentSession(dict(parameters), plan, SimulatedWindow(clock),
+                                                  SimulatedEvent(parameters['WaitKey']), clock, constant.KEYBOARD,
+                                                  device_reader, NullStimulusCache(), report_worker, None,
+                                                  version='simulation', author='c_simulation')
+    step_results = session.run(block_trials, (), subject_id)
+    return step_results, clock.getTime()
+
+
+def simulate_sessions(paradigm, count, output_dir, seed=None, **response_options):
+    """Runs sessions of simulated participants. The session seeds are derived from one seed, so a seeded run
+    reproduces its reports.
+    :param paradigm: layout name in c_plan.LAYOUTS
+    :param count: number of sessions
+    :param output_dir: directory of the report files
+    :param seed: seed of all sessions or 'None' for a new random seed
+    :param response_options: reaction time distribution, accuracy and miss rate, see sample_responses
+    :return: list of dictionaries step -> c_result.Result and the summed virtual session time in seconds
+    """
+    parameters = get_parameters(paradigm, output_dir)
+    session_seeds = numpy.random.SeedSequence(c_plan.get_seed(seed)).generate_state(count, numpy.uint64)
+    report_worker = c_file.ReportWorker()
+    results = []
+    virtual_time = 0.0
+    try:
+        for i, session_seed in enumerate(session_seeds):
+            subject_id = '%s%05d' % (constant.SIMULATION_SUBJECT_PREFIX, i + 1)
+            step_results, session_time = simulate_session(paradigm, parameters, subject_id, int(session_seed),
+                                                          report_worker, **response_options)
+            results.append(step_results)
+            virtual_time += session_time
+    finally:
+        report_worker.shutdown()
+    return results, virtual_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run sessions of simulated participants.')
+    parser.add_argument('paradigm', choices=sorted(c_plan.LAYOUTS))
+    parser.add_argument('--sessions', type=int, default=1, help='number of sessions')
+    parser.add_argument('--seed', type=int, default=None, help='seed of all sessions (default: random)')
+    parser.add_argument('--output-dir', default='simulation_result_files', help='directory of the report files')
+    parser.add_argument('--rt-mu', type=float, default=constant.SIMULATION_RT_MU)
+    parser.add_argument('--rt-sigma', type=float, default=constant.SIMULATION_RT_SIGMA)
+    parser.add_argument('--rt-tau', type=float, default=constant.SIMULATION_RT_TAU)
+    parser.add_argument('--accuracy', type=float, default=constant.SIMULATION_ACCURACY)
+    parser.add_argument('--miss-rate', type=float, default=constant.SIMULATION_MISS_RATE)
+    args = parser.parse_args(argv)
+    start_time = time.perf_counter()
+    results, virtual_time = simulate_sessions(args.paradigm, args.sessions, args.output_dir, args.seed,
+                                              rt_mu=args.rt_mu, rt_sigma=args.rt_sigma, rt_tau=args.rt_tau,
+                                              accuracy=args.accuracy, miss_rate=args.miss_rate)
+    wall_time = time.perf_counter() - start_time
+    print('%d sessions in %.2f s (%.0f s session time, %.0fx real time)'
+          % (len(results), wall_time, virtual_time, virtual_time / max(wall_time, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Startup of the experiment scripts. The MilliKey device is discovered and opened on a separate thread while
+PsychoPy is loaded and the window is created; the durations of the startup phases can be printed."""
+
+from __future__ import absolute_import, division, print_function
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import c_device
+import constant
+
+
+class StartupTimer:
+    """Durations of the startup phases. Phases of the main thread follow each other, phases of other threads
+    (device probing) are recorded with their own duration."""
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.last_time = self.start_time
+        self.phases = []
+
+    def mark(self, name):
+        """Ends phase of the main thread.
+        :param name: phase name
+        """
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last_time, False))
+        self.last_time = now
+
+    def add(self, name, duration):
+        """Records phase carried out concurrently to the main thread.
+        :param name: phase name
+        :param duration: duration in seconds
+        """
+        self.phases.append((name, duration, True))
+
+    def report(self):
+        """Prints the startup time breakdown."""
+        print('startup time breakdown:')
+        for name, duration, concurrent in self.phases:
+            print('  %-28s %8.1f ms%s' % (name, duration * 1000, ' (concurrent)' if concurrent else ''))
+        print('  %-28s %8.1f ms' % ('total', (self.last_time - self.start_time) * 1000))
+
+
+def get_screen_size():
+    """Gets size of the primary screen for full screen mode. win32api is imported on first use.
+    :return: (width, height) or 'None', if the screen size is not available
+    """
+    try:
+        import win32api
+        return win32api.GetSystemMetrics(0), win32api.GetSystemMetrics(1)
+    except Exception:
+        return None
+
+
+def probe_device(state_file, default_port, timer=None):
+    """Discovers MilliKey device and opens its session.
+    :param state_file: path of the file caching the last good port
+    :param default_port: port used if no MilliKey port was discovered
+    :param timer: StartupTimer or 'None'
+    :return: current device (KEYBOARD or PSYCHO_TOOLBOX) and c_device.MilliKeySession or 'None'
+    """
+    start_time = time.perf_counter()
+    serial_ports = c_device.get_millikey_serial_port(state_file)
+    print('port=', serial_ports)
+    mk_connection = c_device.open_millikey_session(serial_ports[0] if serial_ports else default_port)
+    if timer is not None:
+        timer.add('device probe', time.perf_counter() - start_time)
+    if mk_connection is None:
+        print('MilliKey device not available')
+        return constant.KEYBOARD, None
+    return constant.PSYCHO_TOOLBOX, mk_connection
+
+
+def start_device_probe(state_file, default_port, timer=None):
+    """Starts probe_device on a separate thread.
+    :param state_file: path of the file caching the last good port
+    :param default_port: port used if no MilliKey port was discovered
+    :param timer: StartupTimer or 'None'
+    :return: concurrent.futures.Future of the probe_device result
+    """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='DeviceProbe')
+    future = executor.submit(probe_device, state_file, default_port, timer)
+    executor.shutdown(wait=False)
+    return future
@@ -0,0 +1,93 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Stimulus cache. Every image in the picture directory is decoded once at startup and one stimulus instance is
+kept per (element, position) pair, positioned when it is created. Each distinct screen (e.g. cross and left heart)
+is composed once into a single texture, so trials draw one cached screen without any setPos call, image decoding
+or texture upload on the first frame of a stimulus."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import c_visual
+import constant
+
+
+def load_images(pic_path):
+    """Decodes all images of the picture directory.
+    :param pic_path: picture directory path
+    :return: dictionary file name -> decoded PIL image
+    """
+    from PIL import Image
+    images = {}
+    for file_name in sorted(os.listdir(pic_path)):
+        if os.path.splitext(file_name)[1].lower() not in constant.STIMULUS_IMAGE_EXTENSIONS:
+            continue
+        image = Image.open(os.path.join(pic_path, file_name))
+        image.load()
+        # palette images (GIF) are converted once here instead of on every texture creation
+        images[file_name] = image if image.mode in ('RGB', 'RGBA', 'L', 'LA') else image.convert('RGBA')
+    return images
+
+
+class StimulusCache:
+    """Positioned stimulus instances of one window. Images are addressed by file name, other elements (e.g. the
+    fixation cross lines) by the name they were registered with."""
+    def __init__(self, exp_win, pic_path):
+        self.exp_win = exp_win
+        self.images = load_images(pic_path)
+        self.factories = {}
+        self.instances = {}
+        self.compositor = c_visual.ScreenCompositor(exp_win)
+
+    def register(self, name, factory):
+        """Registers non-image element.
+        :param name: element name
+        :param factory: function without arguments creating a new element instance
+        """
+        self.factories[name] = factory
+
+    def get(self, name, pos):
+        """Gets positioned element instance, created on first use.
+        :param name: image file name or registered element name
+        :param pos: element position
+        :return: element instance
+        """
+        key = (name, pos)
+        instance = self.instances.get(key)
+        if instance is None:
+            if name in self.factories:
+                instance = self.factories[name]()
+            else:
+                from psychopy import visual
+                instance = visual.ImageStim(self.exp_win, image=self.images[name])
+            instance.setPos(pos)
+            self.instances[key] = instance
+        return instance
+
+    def prepare(self, names, elements_pos):
+        """Gets positioned instances of elements, following the positioning of c_visual.draw_elements_without_text.
+        :param names: image file names or registered element names
+        :param elements_pos: positions of the elements
+        :return: tuple of element instances, drawn without positions
+        """
+        return tuple(self.get(name, elements_pos[i]) for i, name in enumerate(names[:3]))
+
+    def get_screen(self, names, elements_pos):
+        """Gets composite screen of the positioned elements, rendered once.
+        :param names: image file names or registered element names
+        :param elements_pos: positions of the elements
+        :return: tuple with the composite screen, drawn without positions
+        """
+        screen = self.compositor.get((tuple(names), elements_pos), self.prepare(names, elements_pos))
+        return (screen,)
+
+    def warm_up(self):
+        """Draws all instances and screens once into the back buffer, so their textures are resident before the
+        first trial. The back buffer is cleared afterwards, nothing is shown.
+        """
+        for instance in self.instances.values():
+            instance.draw()
+        for screen in self.compositor.screens.values():
+            screen.draw()
+        self.exp_win.clearBuffer()
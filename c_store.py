@@ -0,0 +1,135 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Structured per-trial session store, written next to the single report. The store is a NumPy structured
+array saved as '.npy' file, so sessions can be memory mapped and a whole cohort can be loaded at once"""
+
+from __future__ import absolute_import, division, print_function
+
+import glob
+import io
+import os
+
+import numpy
+
+import c_file
+import constant
+
+# one record per trial; rt, onset and jitter in seconds, dropped is the number of frames dropped from the
+# fixation onset to the answer or timeout, correct is -1 for trials without answer (timeout).
+# answer, correct and rt follow the too fast rule of the session, the raw fields keep the key press itself, so the
+# rule can be changed at analysis time
+TRIAL_DTYPE = numpy.dtype([
+    ('subject', 'U16'),
+    ('step', 'i2'),
+    ('trial', 'i4'),
+    ('pos', 'U8'),
+    ('color', 'U8'),
+    ('answer', 'U1'),
+    ('correct', 'i1'),
+    ('rt', 'f8'),
+    ('onset', 'f8'),
+    ('jitter', 'f8'),
+    ('dropped', 'i2'),
+    ('raw_answer', 'U1'),
+    ('raw_correct', 'i1'),
+    ('raw_rt', 'f8'),
+])
+
+
+class RecordStore:
+    """Records of a single session. Records are collected in a preallocated structured array, which grows on
+    demand, and are saved as '.npy' file at step boundaries."""
+    def __init__(self, path, dtype, capacity=constant.TRIAL_STORE_CAPACITY):
+        self.path = path
+        self.step = 0
+        self._records = numpy.zeros(capacity, dtype=dtype)
+        self._count = 0
+
+    @property
+    def records(self):
+        """Structured array of the collected records"""
+        return self._records[:self._count]
+
+    def begin_step(self, step):
+        """Sets step number of the following records.
+        :param step: step number
+        """
+        self.step = step
+
+    def add(self, record):
+        """Appends record.
+        :param record: tuple of the field values
+        """
+        if self._count == len(self._records):
+            self._records = numpy.resize(self._records, 2 * len(self._records))
+        self._records[self._count] = record
+        self._count += 1
+
+    def save(self):
+        """Saves collected records. The file is replaced atomically."""
+        buffer = io.BytesIO()
+        numpy.save(buffer, self.records)
+        c_file.write_atomic(self.path, buffer.getvalue(), 'wb')
+
+
+class TrialStore(RecordStore):
+    """Per-trial records of a single session."""
+    def __init__(self, path, subject_id, capacity=constant.TRIAL_STORE_CAPACITY):
+        RecordStore.__init__(self, path, TRIAL_DTYPE, capacity)
+        self.subject_id = subject_id
+
+    def append(self, count, pos, color, answer, correctness, diff_time, onset_time, onset_jitter, dropped_frames,
+               raw_response=None):
+        """Appends trial record.
+        :param count: current stimuli index, beginning with 0
+        :param pos: element position
+        :param color: currently 'red' or 'blue'
+        :param answer: proband answer. ('L', 'R' or '-')
+        :param correctness: correctness of the answer. '0', '1' or '-' for no answer
+        :param diff_time: reaction time in seconds
+        :param onset_time: stimulus onset (flip time stamp) in seconds
+        :param onset_jitter: difference between actual and intended stimulus onset in seconds
+        :param dropped_frames: number of frames dropped in the trial window
+        :param raw_response: answer, correctness and reaction time of the key press before the too fast rule was
+        applied or 'None', if the answer was taken as it is
+        """
+        raw_answer, raw_correctness, raw_time = (answer, correctness, diff_time) if raw_response is None \
+            else raw_response
+        self.add((self.subject_id, self.step, count + 1, pos, color, answer, get_correct(correctness), diff_time,
+                  onset_time, onset_jitter, dropped_frames, raw_answer, get_correct(raw_correctness), raw_time))
+
+
+def get_correct(correctness):
+    """Gets correctness as stored.
+    :param correctness: correctness of the answer. '0', '1' or '-' for no answer
+    :return: 0, 1 or -1 for no answer
+    """
+    return -1 if correctness == constant.STIMULI_NO_ANSWER else int(correctness)
+
+
+def get_store_path(report_path):
+    """Gets store file path for single report file path.
+    :param report_path: single report file path
+    :return: store file path
+    """
+    return os.path.splitext(report_path)[0] + constant.TRIAL_STORE_SUFFIX
+
+
+def load_session(path):
+    """Loads records of a single session as memory mapped array.
+    :param path: store file path
+    :return: structured array with TRIAL_DTYPE
+    """
+    return numpy.load(path, mmap_mode='r')
+
+
+def load_cohort(data_path, pattern='*'):
+    """Loads records of all sessions in a data directory.
+    :param data_path: data directory
+    :param pattern: file name pattern, e.g. 'Dots_*'
+    :return: structured array with TRIAL_DTYPE containing the records of all sessions
+    """
+    paths = sorted(glob.glob(os.path.join(data_path, pattern + constant.TRIAL_STORE_SUFFIX)))
+    if not paths:
+        return numpy.zeros(0, dtype=TRIAL_DTYPE)
+    return numpy.concatenate([load_session(path) for path in paths])
@@ -0,0 +1,129 @@
+﻿#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Frame-counted trial timeline. The refresh period is measured once per window, the fixation (blank interval)
+and response timeout durations are converted to whole numbers of frames, and presentation is driven by flips:
+the stimulus flip follows the fixation onset after exactly the planned number of frames. Planned and actual
+durations of every test trial are stored next to the single report as NumPy structured array."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import numpy
+
+import c_store
+import c_visual
+import constant
+
+# one record per trial, durations in seconds; the response duration ends with the answer or the timeout
+TIMELINE_DTYPE = numpy.dtype([
+    ('step', 'i2'),
+    ('trial', 'i4'),
+    ('blank_frames', 'i4'),
+    ('blank_planned', 'f8'),
+    ('blank_actual', 'f8'),
+    ('response_frames', 'i4'),
+    ('response_planned', 'f8'),
+    ('response_actual', 'f8'),
+])
+
+
+def measure_frame_period(exp_win):
+    """Measures refresh period of the window once. Falls back to the nominal frame period, if the refresh rate
+    could not be measured.
+    :param exp_win: visual.Window
+    :return: frame period in seconds
+    """
+    frame_rate = exp_win.getActualFrameRate() if hasattr(exp_win, 'getActualFrameRate') else None
+    if frame_rate:
+        return 1.0 / frame_rate
+    return c_visual.get_frame_period(exp_win)
+
+
+def get_frame_count(duration, frame_period):
+    """Converts duration into number of frames.
+    :param duration: duration in seconds
+    :param frame_period: frame period in seconds
+    :return: number of frames, at least one
+    """
+    return max(1, int(round(duration / frame_period)))
+
+
+def get_timeline_path(report_path):
+    """Gets timeline file path for single report file path.
+    :param report_path: single report file path
+    :return: timeline file path
+    """
+    return os.path.splitext(report_path)[0] + constant.TIMELINE_FILE_SUFFIX
+
+
+class TimelineScheduler:
+    """Presents fixation and stimulus screens for planned numbers of frames of one window."""
+    def __init__(self, exp_win, frame_period, blank_duration, response_duration):
+        self.exp_win = exp_win
+        self.frame_period = frame_period
+        self.blank_frames = get_frame_count(blank_duration, frame_period)
+        self.response_frames = get_frame_count(response_duration, frame_period)
+        self.dropped_frames = 0
+        self.last_flip = None
+
+    @property
+    def blank_planned(self):
+        """Planned duration of the fixation screen in seconds"""
+        return self.blank_frames * self.frame_period
+
+    @property
+    def response_planned(self):
+        """Planned response timeout in seconds"""
+        return self.response_frames * self.frame_period
+
+    def show(self, screen):
+        """Shows screen on the next frame. Frames dropped since the previous flip of the trial are counted.
+        :param screen: elements to draw, positioned by c_stimcache
+        :return: flip time stamp
+        """
+        flip_time = c_visual.draw_elements_without_text(screen, None, self.exp_win)
+        if self.last_flip is not None:
+            self.dropped_frames += c_visual.get_dropped_frames(flip_time - self.last_flip, self.frame_period)
+        self.last_flip = flip_time
+        return flip_time
+
+    def show_blank(self, screen, blank_task=None):
+        """Shows fixation screen for the planned number of frames. The flip after this call is the stimulus onset.
+        The fixation onset starts the trial window, in which dropped frames are counted.
+        :param screen: fixation screen elements
+        :param blank_task: optional function carried out after the first frame (e.g. report flushing)
+        :return: flip time stamp of the fixation onset
+        """
+        self.dropped_frames = 0
+        self.last_flip = None
+        onset_time = self.show(screen)
+        if blank_task is not None:
+            blank_task()
+        for _ in range(self.blank_frames - 1):
+            self.show(screen)
+        return onset_time
+
+    def get_intended_onset(self, blank_onset):
+        """Gets intended stimulus onset.
+        :param blank_onset: flip time stamp of the fixation onset
+        :return: time stamp of the frame following the planned fixation frames
+        """
+        return blank_onset + self.blank_planned
+
+
+class TimelineStore(c_store.RecordStore):
+    """Planned and actual durations of the test trials of a single session."""
+    def __init__(self, path, capacity=constant.TRIAL_STORE_CAPACITY):
+        c_store.RecordStore.__init__(self, path, TIMELINE_DTYPE, capacity)
+
+    def append(self, count, scheduler, blank_actual, response_frames, response_actual):
+        """Appends trial record.
+        :param count: current stimuli index, beginning with 0
+        :param scheduler: TimelineScheduler of the trial
+        :param blank_actual: time from fixation onset to stimulus onset in seconds
+        :param response_frames: number of frames the stimulus was held
+        :param response_actual: time from stimulus onset to answer or timeout in seconds
+        """
+        self.add((self.step, count + 1, scheduler.blank_frames, scheduler.blank_planned, blank_actual,
+                  response_frames, scheduler.response_planned, response_actual))
@@ -4,11 +4,18 @@
 
 from __future__ import absolute_import, division, print_function
 
-from psychopy import visual
+import time
+
+import numpy
+
+import constant
+
+# psychopy.visual is imported on first use, i.e. at window creation, see c_startup
 
 
 # gets main window
 def get_exp_win(parameters):
+   from psychopy import visual
    return visual.Window(parameters['ScreenSize'], units=parameters['ScreenUnits'], fullscr=parameters['FullScr'],
                         screen=parameters['NoMonitor'], color=parameters['BackColor'],
                         allowGUI=not parameters['FullScr'])
@@ -16,18 +23,21 @@ def get_exp_win(parameters):
 
 # creates cross line 1
 def get_cross_line_1(exp_win, parameters):
+    from psychopy import visual
     return visual.Line(exp_win, units='pix', start=(- parameters['FLeng'], 0), end=(parameters['FLeng'], 0),
                        lineWidth=parameters['FWi'], lineColor=parameters['Fcolor'])
 
 
 # creates cross line 2
 def get_cross_line_2(exp_win, parameters):
+    from psychopy import visual
     return visual.Line(exp_win, units='pix', start=(0, - parameters['FLeng']), end=(0, parameters['FLeng']),
                        lineWidth=parameters['FWi'], lineColor=parameters['Fcolor'])
 
 
 # creates instructional text
 def get_instruct_text(exp_win, parameters):
+    from psychopy import visual
     return visual.TextStim(exp_win, units=parameters['TextUnit'], height=parameters['InstructHeight'],
                            pos=parameters['InstructPos'], font=parameters['TextFont'], bold=parameters['TextBold'],
                            text=parameters['InstructText'])
@@ -36,70 +46,209 @@ def get_instruct_text(exp_win, parameters):
 def draw_elements_without_text(elements, elements_pos, exp_win):
     """Draw elements without text.
     :param elements: elements to draw
-    :param elements_pos: positions of the elements to draw
+    :param elements_pos: positions of the elements to draw or 'None' for elements positioned by c_stimcache
     :param exp_win: visual.Window
+    :return: flip time stamp (core.monotonicClock), i.e. the onset of the drawn elements
     """
+    if elements_pos is None:
+        for Element in elements:
+            Element.draw()
+        return exp_win.flip()
     i = 0
     for Element in elements:
         if i < 3 and type(Element) != str:
             Element.setPos(elements_pos[i])
             Element.draw()
         i += 1
-    exp_win.flip()
+    return exp_win.flip()
 
 
-def draw_elements(elements, elements_pos, wait_text_element, wait_text, exp_win):
-    """Draw elements.
-    :param elements: elements to draw
-    :param elements_pos: positions of the elements to draw
-    :param wait_text_element: wait text element
-    :param wait_text: wait text
+def compose_screen(exp_win, elements, text_element=None, text=None):
+    """Renders elements and text once into a single texture, so the screen is shown by one blit.
     :param exp_win: visual.Window
+    :param elements: positioned elements
+    :param text_element: text element or 'None'
+    :param text: text of the text element or 'None' to keep its text
+    :return: visual.BufferImageStim
     """
-    if wait_text:
-        wait_text_element.setText(wait_text)
-        wait_text_element.draw()
-    draw_elements_without_text(elements, elements_pos, exp_win)
+    stims = list(elements)
+    if text_element is not None:
+        if text:
+            text_element.setText(text)
+        stims.append(text_element)
+    from psychopy import visual
+    screen = visual.BufferImageStim(exp_win, stim=stims)
+    exp_win.clearBuffer()
+    return screen
+
 
+class ScreenCompositor:
+    """Composite screens of one window (fixation cross, trial screens, instruction pages). Each distinct screen
+    is rendered once by compose_screen and drawn as a single texture afterwards."""
+    def __init__(self, exp_win):
+        self.exp_win = exp_win
+        self.screens = {}
 
-def instruct_cross_wait(elements, elements_pos, exp_win, time, blank_duration, event):
-    """Draw cross and wait shortly for key input.
-    :param elements: cross elements to draw
-    :param elements_pos: positions of the cross elements to draw
+    def get(self, key, elements, text_element=None, text=None):
+        """Gets composite screen, rendered on first use.
+        :param key: screen key, e.g. element names and positions
+        :param elements: positioned elements
+        :param text_element: text element or 'None'
+        :param text: text of the text element or 'None'
+        :return: visual.BufferImageStim
+        """
+        screen = self.screens.get(key)
+        if screen is None:
+            screen = compose_screen(self.exp_win, elements, text_element, text)
+            self.screens[key] = screen
+        return screen
+
+
+def get_frame_period(exp_win):
+    """Gets duration of a single frame.
     :param exp_win: visual.Window
-    :param time: import time
-    :param blank_duration: waiting time between stimuli in seconds
+    :return: frame period in seconds
+    """
+    return exp_win.monitorFramePeriod
+
+
+def get_dropped_frames(flip_interval, frame_period):
+    """Gets number of frames dropped between two consecutive flips.
+    :param flip_interval: time between the flips in seconds
+    :param frame_period: frame period in seconds
+    :return: number of dropped frames, at least one for intervals longer than constant.DROPPED_FRAME_THRESHOLD
+    frame periods
+    """
+    if flip_interval <= constant.DROPPED_FRAME_THRESHOLD * frame_period:
+        return 0
+    return max(1, int(round(flip_interval / frame_period)) - 1)
+
+
+def get_percentiles(values, scale=1000.0):
+    """Gets mean, 95th and 99th percentile of recorded times.
+    :param values: array of times in seconds
+    :param scale: factor applied to the results, default milliseconds
+    :return: dictionary with 'mean', 'p95' and 'p99' or 'None' values, if nothing was recorded
+    """
+    if not len(values):
+        return {'mean': None, 'p95': None, 'p99': None}
+    p95, p99 = numpy.percentile(values, (95, 99)) * scale
+    return {'mean': float(numpy.mean(values)) * scale, 'p95': float(p95), 'p99': float(p99)}
+
+
+class FrameTimer:
+    """Opt-in frame timing instrumentation of a window. install() wraps the flip of the window without changing the
+    callers. Flip intervals are recorded into a preallocated ring buffer only inside the trial window, between
+    start() at the fixation onset and stop() at the response or timeout, so untimed waits (dialogs, proband id
+    input) are not taken as flip intervals. Trial onsets are recorded with their jitter and dropped frames."""
+    def __init__(self, exp_win, frame_period, capacity=constant.FRAME_TIMER_CAPACITY):
+        self.exp_win = exp_win
+        self.frame_period = frame_period
+        self.intervals = numpy.zeros(capacity)
+        self.onset_jitters = numpy.zeros(capacity)
+        self.onset_drops = numpy.zeros(capacity, dtype=numpy.int32)
+        self._window_flip = exp_win.flip
+        self.reset()
+
+    def reset(self):
+        """Clears recorded flips and onsets, e.g. for a new session."""
+        self.flip_count = 0
+        self.onset_count = 0
+        self.dropped_frame_count = 0
+        self.last_flip = None
+        self.recording = False
+
+    def start(self):
+        """Starts recording flip intervals, beginning with the next flip."""
+        self.last_flip = None
+        self.recording = True
+
+    def stop(self):
+        """Stops recording flip intervals."""
+        self.recording = False
+        self.last_flip = None
+
+    def install(self):
+        """Replaces the flip of the window by the recording flip."""
+        self.exp_win.flip = self.flip
+
+    def uninstall(self):
+        """Restores the flip of the window."""
+        self.exp_win.flip = self._window_flip
+
+    def flip(self, *args, **kwargs):
+        """Flips the window and records the interval to the previous flip, if recording.
+        :return: flip time stamp as returned by the window
+        """
+        flip_time = self._window_flip(*args, **kwargs)
+        if not self.recording:
+            return flip_time
+        if self.last_flip is not None:
+            self.intervals[self.flip_count % len(self.intervals)] = flip_time - self.last_flip
+            self.flip_count += 1
+        self.last_flip = flip_time
+        return flip_time
+
+    def add_onset(self, onset_jitter, dropped_frames):
+        """Records trial onset.
+        :param onset_jitter: difference between actual and intended onset in seconds
+        :param dropped_frames: number of frames dropped in the trial window (fixation, onset and response hold)
+        """
+        index = self.onset_count % len(self.onset_jitters)
+        self.onset_jitters[index] = onset_jitter
+        self.onset_drops[index] = dropped_frames
+        self.onset_count += 1
+        self.dropped_frame_count += dropped_frames
+
+    def get_summary(self):
+        """Gets timing summary of the recorded flips and onsets. Statistics cover the last 'capacity' entries.
+        :return: dictionary of the summary values, times in milliseconds
+        """
+        intervals = self.intervals[:min(self.flip_count, len(self.intervals))]
+        onset_jitters = self.onset_jitters[:min(self.onset_count, len(self.onset_jitters))]
+        onset_drops = self.onset_drops[:min(self.onset_count, len(self.onset_drops))]
+        return {'frame_period_ms': self.frame_period * 1000.0, 'flips': self.flip_count,
+                'flip_interval_ms': get_percentiles(intervals), 'trials': self.onset_count,
+                'onset_jitter_ms': get_percentiles(onset_jitters), 'dropped_frames': self.dropped_frame_count,
+                'dropped_frame_trials': int(numpy.count_nonzero(onset_drops))}
+
+
+def wait_keys(event, key_list=None, poll_interval=constant.IDLE_POLL_INTERVAL):
+    """Waits for key events without busy waiting. The key events are polled with a short sleep in between, so an
+    idle screen (instructions, proband id input) takes almost no CPU time.
     :param event: from psychoPy import event
-    :return: 'q', is 'escape' keyboard key was pressed, otherwise empty
+    :param key_list: keys to wait for or 'None' for any key
+    :param poll_interval: sleep time between polls in seconds
+    :return: list of pressed keys
     """
-    pressed_key = ''
-    draw_elements_without_text(elements, elements_pos, exp_win)
-    time.sleep(blank_duration)
-    for keys in event.getKeys():
-        if keys in ['q', 'escape']:
-            pressed_key = 'q'
-        if keys in ['escape', 'q']:
-            pressed_key = 'q'
-    return pressed_key
+    while True:
+        keys = event.getKeys(keyList=key_list)
+        if keys:
+            return keys
+        time.sleep(poll_interval)
 
 
-def instruct_wait(wait_text_element, wait_text, wait_key, exp_win, event):
+def instruct_wait(wait_text_element, wait_text, wait_key, exp_win, event, compositor=None):
     """Draw text element and wait for key input.
     :param wait_text_element: text elements to draw
     :param wait_text: wait text
     :param wait_key: 'Leertaste'
     :param exp_win: visual.Window
     :param event: from psychoPy import event
+    :param compositor: ScreenCompositor rendering each instruction page once or 'None'
     :return: 'q', is 'escape' keyboard key was pressed, otherwise empty
     """
     pressed_key = ''
-    if wait_text:
-        wait_text_element.setText(wait_text)
-    wait_text_element.draw()
+    if compositor is not None:
+        compositor.get(('text', wait_text), (), wait_text_element, wait_text).draw()
+    else:
+        if wait_text:
+            wait_text_element.setText(wait_text)
+        wait_text_element.draw()
     exp_win.flip()
     flag_wait = True
     while flag_wait:
-        for keys in event.getKeys():
+        for keys in wait_keys(event):
             if keys in ['q', 'escape']:
                 pressed_key = 'q'
             if keys in ['escape', 'q']:
@@ -1,12 +1,64 @@
 """Experiment related constants"""
 PSYCHO_TOOLBOX = 'MilliKey'
 KEYBOARD = 'Tastatur'
-# Use MilliKey will wait before issuing the requested key press event.
-MILLI_KEY_DELAY = 5000
+MILLI_KEY_BAUDRATE = 128000
+MILLI_KEY_TIMEOUT = 0.1
+# MilliKey port discovery: USB vendor ids (PJRC Teensy based devices), descriptor names and cached port file
+MILLI_KEY_USB_VENDOR_IDS = (0x16C0,)
+MILLI_KEY_DESCRIPTORS = ('millikey', 'labhackers')
+MILLI_KEY_STATE_FILE = '.millikey_port'
+# Maximum number of time stamped device events waiting for the trial loop
+DEVICE_QUEUE_SIZE = 64
 REPORT_FILE_NAME = '_all_analysed_data.txt'
+# single report files are written with this suffix until the session has ended
+PARTIAL_FILE_SUFFIX = '.part'
+# structured per-trial session store, written next to the single report
+TRIAL_STORE_SUFFIX = '.npy'
+TRIAL_STORE_CAPACITY = 256
+# frame timing summary written next to the single report (opt-in) and number of recorded flips and onsets
+TIMING_SUMMARY_SUFFIX = '.timing.json'
+FRAME_TIMER_CAPACITY = 65536
+# flip intervals longer than this number of frame periods have dropped frames
+DROPPED_FRAME_THRESHOLD = 1.5
+# planned and actual trial durations (.npy format), not matched by the trial store pattern
+TIMELINE_FILE_SUFFIX = '.timeline'
+# general analysis report: per-session fragment directory and lock file for merging
+FRAGMENT_DIR_SUFFIX = '.d'
+LEGACY_FRAGMENT_NAME = '00000000_000000_legacy.txt'
+LOCK_FILE_SUFFIX = '.lock'
+# waiting time of the merge exceeds the time after which an unchanged lock is stale
+LOCK_TIMEOUT = 90.0
+LOCK_STALE_TIME = 60.0
+LOCK_RETRY_TIME = 0.05
+# number of reaction times, up to which the streaming median is exact
+STREAMING_MEDIAN_EXACT_LIMIT = 128
+# trial sequence generation: candidate batch size, attempts and allowed difference of transition type counts
+SEQUENCE_BATCH_SIZE = 4096
+SEQUENCE_MAX_BATCHES = 64
+TRANSITION_TOLERANCE = 1
+# image files decoded by the stimulus cache
+STIMULUS_IMAGE_EXTENSIONS = ('.gif', '.jpg', '.jpeg', '.png', '.bmp')
+# key polling interval of instruction and input screens in seconds
+IDLE_POLL_INTERVAL = 0.01
+# session plan files
+PLAN_FORMAT_VERSION = 1
+PLAN_FILE_SUFFIX = '.json'
+# copy of the session plan written next to the single report
+REPORT_PLAN_SUFFIX = '.plan' + PLAN_FILE_SUFFIX
+# simulated participant: ex-Gaussian reaction time (mu, sigma, tau in seconds), accuracy, missed trials and display
+SIMULATION_RT_MU = 0.45
+SIMULATION_RT_SIGMA = 0.08
+SIMULATION_RT_TAU = 0.15
+SIMULATION_ACCURACY = 0.9
+SIMULATION_MISS_RATE = 0.02
+SIMULATION_FRAME_PERIOD = 1.0 / 60
+SIMULATION_SUBJECT_PREFIX = 'sim'
 STIMULI_NO_ANSWER = "-"
 STIMULI_IMAGE_POSITION_LEFT = 'L'
 STIMULI_IMAGE_POSITION_RIGHT = 'R'
+STIMULI_IMAGE_POSITION_CENTRE = 'C'
+STIMULI_CONGRUENT = '1'
+STIMULI_UNCONGRUENT = '0'
 KEY_PRESSED_LEFT = 'L'
 KEY_PRESSED_RIGHT = 'R'
 ANSWER_CORRECT = '1'
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of the MilliKey port discovery against pty-backed fake serial ports (Linux)."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import c_device  # noqa: E402
+import constant  # noqa: E402
+
+from serial.tools import list_ports, list_ports_common  # noqa: E402
+
+
+def open_fake_port():
+    """Opens pty pair, the slave end acts as serial port.
+    :return: master and slave file descriptor and serial port address
+    """
+    master, slave = os.openpty()
+    return master, slave, os.ttyname(slave)
+
+
+def get_port_info(port, vid, description):
+    """Gets port list entry as reported by list_ports.comports.
+    :param port: serial port address
+    :param vid: USB vendor id
+    :param description: port description
+    :return: list_ports_common.ListPortInfo
+    """
+    port_info = list_ports_common.ListPortInfo(port, skip_link_detection=True)
+    port_info.vid = vid
+    port_info.pid = 0x0001
+    port_info.description = description
+    return port_info
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'pty-backed fake ports need Linux')
+class MilliKeyDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.fds = []
+        self.millikey_port = self.add_fake_port()
+        self.foreign_port = self.add_fake_port()
+        self.port_infos = [get_port_info(self.foreign_port, 0x0403, 'FT232R USB UART'),
+                           get_port_info(self.millikey_port, constant.MILLI_KEY_USB_VENDOR_IDS[0], 'USB Serial')]
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, constant.MILLI_KEY_STATE_FILE)
+
+    def tearDown(self):
+        for fd in self.fds:
+            os.close(fd)
+        shutil.rmtree(self.state_dir)
+
+    def add_fake_port(self):
+        master, slave, port = open_fake_port()
+        self.fds.extend((master, slave))
+        return port
+
+    def get_port(self):
+        with mock.patch.object(list_ports, 'comports', return_value=self.port_infos), \
+                mock.patch.object(c_device, 'probe_serial_port', wraps=c_device.probe_serial_port) as probe:
+            return c_device.get_millikey_serial_port(self.state_file), [call.args[0] for call in probe.call_args_list]
+
+    def test_only_millikey_port_is_probed(self):
+        ports, probed = self.get_port()
+        self.assertEqual(ports, [self.millikey_port])
+        self.assertEqual(probed, [self.millikey_port])
+
+    def test_cached_port_short_circuits_discovery(self):
+        self.get_port()
+        with open(self.state_file) as file:
+            self.assertEqual(file.read(), self.millikey_port)
+        with mock.patch.object(c_device, 'is_millikey_port_info') as is_millikey_port_info:
+            ports, probed = self.get_port()
+        self.assertEqual(ports, [self.millikey_port])
+        self.assertEqual(probed, [self.millikey_port])
+        is_millikey_port_info.assert_not_called()
+
+    def test_missing_cached_port_is_rediscovered(self):
+        c_device.write_cached_port(self.state_file, '/dev/ttyACM99')
+        ports, probed = self.get_port()
+        self.assertEqual(ports, [self.millikey_port])
+        self.assertEqual(probed, [self.millikey_port])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of the device reader thread with the keyboard backends of the supported psychoPy versions."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import c_device  # noqa: E402
+import constant  # noqa: E402
+
+
+class KeyPress:
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+
+
+class Keyboard:
+    """Keyboard of psychoPy 2020.2: no backend attribute, psychtoolbox is chosen by keyboard.havePTB"""
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.keys = []
+
+    def getKeys(self, keyList=None, waitRelease=True):
+        keys, self.keys = self.keys, []
+        return [key for key in keys if keyList is None or key.name in keyList]
+
+
+class BackendKeyboard(Keyboard):
+    """Keyboard of psychoPy 2022: backend stored in Keyboard._backend and reported by getBackend()"""
+    _backend = None
+
+    def __init__(self, clock=None):
+        Keyboard.__init__(self, clock)
+        BackendKeyboard._backend = BackendKeyboard.backend_name
+
+    def getBackend(self):
+        return self._backend
+
+
+def get_psychopy_modules(keyboard_class, have_ptb=False):
+    """Gets fake psychopy package providing hardware.keyboard.
+    :param keyboard_class: Keyboard class of the keyboard module
+    :param have_ptb: value of keyboard.havePTB
+    :return: dictionary module name -> module, to patch sys.modules with
+    """
+    keyboard = types.ModuleType('psychopy.hardware.keyboard')
+    keyboard.Keyboard = keyboard_class
+    keyboard.havePTB = have_ptb
+    hardware = types.ModuleType('psychopy.hardware')
+    hardware.keyboard = keyboard
+    psychopy = types.ModuleType('psychopy')
+    psychopy.hardware = hardware
+    return {'psychopy': psychopy, 'psychopy.hardware': hardware, 'psychopy.hardware.keyboard': keyboard}
+
+
+class DeviceReaderBackendTest(unittest.TestCase):
+    def start_reader(self, keyboard_class, have_ptb=False):
+        with mock.patch.dict(sys.modules, get_psychopy_modules(keyboard_class, have_ptb)):
+            key_queue = c_device.KeyboardQueue(None)
+        reader = c_device.DeviceReader(constant.KEYBOARD, key_queue, ('left', 'right'), 0.001)
+        reader.start()
+        self.addCleanup(reader.stop)
+        return reader, key_queue
+
+    def test_thread_started_with_have_ptb(self):
+        reader, _ = self.start_reader(Keyboard, have_ptb=True)
+        self.assertTrue(reader.is_threaded)
+        self.assertTrue(reader.is_alive())
+
+    def test_thread_started_with_ptb_backend(self):
+        BackendKeyboard.backend_name = 'ptb'
+        reader, _ = self.start_reader(BackendKeyboard)
+        self.assertTrue(reader.is_alive())
+
+    def test_no_thread_with_event_backend(self):
+        BackendKeyboard.backend_name = 'event'
+        reader, _ = self.start_reader(BackendKeyboard, have_ptb=True)
+        self.assertFalse(reader.is_threaded)
+        self.assertFalse(reader.is_alive())
+
+    def test_thread_delivers_time_stamped_keys(self):
+        reader, key_queue = self.start_reader(Keyboard, have_ptb=True)
+        reader.arm()
+        key_queue._keyboard.keys.append(KeyPress('right', 1.25))
+        self.assertEqual(reader.get(1.0), [[constant.RIGHT_KEYCODE, 1.25]])
+        reader.disarm()
+
+
+if __name__ == '__main__':
+    unittest.main()
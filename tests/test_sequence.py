@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Tests of the counterbalanced trial sequence generator for trial numbers not divisible by the number of cells."""
+
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import c_sequence  # noqa: E402
+import constant  # noqa: E402
+
+NUMBERS = (7, 21, 33)
+SEQUENCES = 50
+MAX_RUN_LENGTH = 3
+# mixed block: expected key and congruency per cell, as built by c_plan.create_plan
+RUN_LABELS = numpy.array([0, 1, 1, 0])
+TRANSITION_LABELS = numpy.array([1, 1, 0, 0])
+
+
+def get_longest_run(labels):
+    """Gets length of the longest run of equal labels.
+    :param labels: label sequence
+    :return: number of trials of the longest run
+    """
+    return max(len(list(run)) for _, run in itertools.groupby(labels))
+
+
+class SequenceGeneratorTest(unittest.TestCase):
+    def generate(self, number, seed, transition_labels=TRANSITION_LABELS):
+        rng = c_sequence.get_rng(seed)
+        cell_counts = c_sequence.get_cell_counts(number, len(RUN_LABELS), rng)
+        sequences = c_sequence.generate_sequences(cell_counts, SEQUENCES, rng, RUN_LABELS, MAX_RUN_LENGTH,
+                                                  transition_labels)
+        return cell_counts, sequences
+
+    def test_exact_cell_counts(self):
+        for number, seed in itertools.product(NUMBERS, range(3)):
+            cell_counts, sequences = self.generate(number, seed)
+            self.assertEqual(int(cell_counts.sum()), number)
+            self.assertLessEqual(int(cell_counts.max() - cell_counts.min()), 1)
+            self.assertEqual(sequences.shape, (SEQUENCES, number))
+            for sequence in sequences:
+                self.assertEqual(numpy.bincount(sequence, minlength=len(cell_counts)).tolist(), cell_counts.tolist())
+
+    def test_max_run_length(self):
+        for number, seed, transition_labels in itertools.product(NUMBERS, range(3), (TRANSITION_LABELS, None)):
+            _, sequences = self.generate(number, seed, transition_labels)
+            for sequence in sequences:
+                self.assertLessEqual(get_longest_run(RUN_LABELS[sequence].tolist()), MAX_RUN_LENGTH)
+            self.assertFalse(c_sequence.get_run_violations(RUN_LABELS[sequences], MAX_RUN_LENGTH).any())
+
+    def test_transition_balance(self):
+        for number, seed in itertools.product(NUMBERS, range(3)):
+            _, sequences = self.generate(number, seed)
+            imbalance = c_sequence.get_transition_imbalance(TRANSITION_LABELS[sequences])
+            self.assertLessEqual(int(imbalance.max()), constant.TRANSITION_TOLERANCE)
+
+    def test_transition_imbalance(self):
+        labels = numpy.array([[0, 0, 1, 1, 0], [0, 1, 0, 1, 0]])
+        # transitions 00, 01, 11, 10 once each; 01 and 10 twice each, 00 and 11 never
+        self.assertEqual(c_sequence.get_transition_imbalance(labels).tolist(), [0, 2])
+
+    def test_same_seed_same_sequences(self):
+        for number in NUMBERS:
+            self.assertTrue(numpy.array_equal(self.generate(number, 5)[1], self.generate(number, 5)[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()